@@ -0,0 +1,82 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Tuple
+
+from benchmark.fake_upstream import FakeUpstream, UpstreamSettings
+from benchmark.load import SCENARIOS, dump_json, format_table, run_scenario
+from benchmark.serve import ROOT
+
+MODES = ('werkzeug', 'hypercorn')
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_port(port: int, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'mirror 进程提前退出，返回码 {proc.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f'mirror 在 {timeout}s 内未监听端口 {port}')
+
+
+def start_mirror(mode: str, upstream: FakeUpstream, fake_redis: bool) -> Tuple[subprocess.Popen, int]:
+    port = _free_port()
+    env = dict(os.environ, UPSTREAM_HOSTS=upstream.upstream_hosts(), PROXY='')
+    cmd = [sys.executable, '-m', 'benchmark.serve', '--port', str(port), '--mode', mode]
+    if fake_redis:
+        cmd.append('--fake-redis')
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    _wait_port(port, proc)
+    return proc, port
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='mirror 吞吐/延迟压测')
+    parser.add_argument('--modes', default=','.join(MODES), help=f'运行模式，可选: {",".join(MODES)}')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'场景，可选: {",".join(SCENARIOS)}')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='每个场景持续秒数')
+    parser.add_argument('--token-rate', type=float, default=50.0, help='模拟 SSE 每秒 token 数，<=0 不限速')
+    parser.add_argument('--tokens', type=int, default=200, help='每次会话输出 token 数')
+    parser.add_argument('--asset-size', type=int, default=64 * 1024, help='静态资源大小（字节）')
+    parser.add_argument('--fake-redis', action='store_true', help='使用 fakeredis，否则连接 REDIS_HOST')
+    parser.add_argument('--json', help='结果额外写入 JSON 文件')
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(settings=UpstreamSettings(args.token_rate, args.tokens, args.asset_size)).start()
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            proc, port = start_mirror(mode, upstream, args.fake_redis)
+            try:
+                for name in args.scenarios.split(','):
+                    result = run_scenario(name, f'http://127.0.0.1:{port}', proc.pid, args.concurrency,
+                                          args.duration)
+                    result['mode'] = mode
+                    results.append(result)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+    finally:
+        upstream.stop()
+
+    print(format_table(results))
+    if args.json:
+        dump_json(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
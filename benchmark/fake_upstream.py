@@ -0,0 +1,193 @@
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+# 模拟的上游域名，端口依次递增
+UPSTREAM_NAMES = ('chatgpt.com', 'cdn.oaistatic.com', 'ab.chatgpt.com')
+
+
+class UpstreamSettings:
+    def __init__(self, token_rate: float = 50.0, tokens: int = 200, asset_size: int = 64 * 1024,
+                 conversation_total: int = 500):
+        """
+        模拟上游的行为参数
+
+        Args:
+            token_rate: SSE 每秒输出的 token 数，<=0 表示不限速
+            tokens: 每次会话输出的 token 数
+            asset_size: 静态资源响应体大小（字节）
+            conversation_total: 会话列表总数
+        """
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.asset_size = asset_size
+        self.conversation_total = conversation_total
+
+
+def _build_asset(size: int) -> bytes:
+    # 包含需要替换的域名，使 modify_response_body 的替换逻辑真实生效
+    line = 'fetch("https://chatgpt.com/backend-api/me");import("https://cdn.oaistatic.com/assets/x.js");\n'
+    return (line * (size // len(line) + 1))[:size].encode()
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'fake-upstream'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def settings(self) -> UpstreamSettings:
+        return self.server.settings
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data, status: int = 200) -> None:
+        self._send(status, json.dumps(data).encode())
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        host = self.server.upstream_name
+        if host == 'cdn.oaistatic.com':
+            self._send(200, self.server.asset_body, 'application/javascript')
+        elif host == 'ab.chatgpt.com':
+            self._send_json({})
+        elif parsed.path == '/backend-api/me':
+            self._send_json(_me())
+        elif parsed.path == '/backend-api/models':
+            self._send_json({'models': [{'slug': slug} for slug in ('gpt-4o', 'gpt-4o-mini', 'o1-mini')]})
+        elif parsed.path == '/backend-api/conversations':
+            self._send_json(self._conversations(parse_qs(parsed.query)))
+        elif parsed.path.startswith('/backend-api/'):
+            self._send_json({})
+        else:
+            self._send(200, b'<html><body>fake</body></html>', 'text/html')
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.server.upstream_name == 'chatgpt.com' and urlparse(self.path).path == '/backend-api/conversation':
+            self._stream_conversation(body)
+        else:
+            self._send_json({})
+
+    def _conversations(self, query: Dict[str, List[str]]) -> Dict:
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', ['28'])[0])
+        total = self.settings.conversation_total
+        items = [
+            {'id': f'conv-{i}', 'title': f'Conversation {i}', 'create_time': '2024-01-01T00:00:00Z'}
+            for i in range(offset, min(offset + limit, total))
+        ]
+        return {'items': items, 'total': total, 'limit': limit, 'offset': offset}
+
+    def _stream_conversation(self, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        conversation_id = str(uuid.uuid4())
+        interval = 1.0 / self.settings.token_rate if self.settings.token_rate > 0 else 0
+        self._write_chunk(
+            f'data: {{"type": "conversation_detail_metadata", "conversation_id": "{conversation_id}"}}\n\n'
+        )
+        text = ''
+        for i in range(self.settings.tokens):
+            text += 'tok '
+            event = {
+                'message': {'id': 'msg', 'content': {'content_type': 'text', 'parts': [text]}},
+                'conversation_id': conversation_id,
+            }
+            self._write_chunk(f'data: {json.dumps(event)}\n\n')
+            if interval:
+                time.sleep(interval)
+        self._write_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data: str) -> None:
+        raw = data.encode()
+        self.wfile.write(f'{len(raw):x}\r\n'.encode() + raw + b'\r\n')
+        self.wfile.flush()
+
+
+def _me() -> Dict:
+    return {
+        'amr': [], 'created': 0, 'email': 'bench@example.com', 'groups': [], 'has_payg_project_spend_limit': False,
+        'id': 'user-bench', 'mfa_flag_enabled': False, 'name': 'bench', 'object': 'user',
+        'orgs': {'object': 'list', 'data': [{'id': 'org-bench', 'description': 'Personal org'}]},
+        'phone_number': '+10000000000', 'picture': '',
+    }
+
+
+class FakeUpstream:
+    """在本地启动 chatgpt.com / cdn.oaistatic.com / ab.chatgpt.com 三个模拟上游"""
+
+    def __init__(self, host: str = '127.0.0.1', base_port: int = 0, settings: UpstreamSettings = None):
+        self.settings = settings or UpstreamSettings()
+        self.servers: Dict[str, ThreadingHTTPServer] = {}
+        asset_body = _build_asset(self.settings.asset_size)
+        for offset, name in enumerate(UPSTREAM_NAMES):
+            server = ThreadingHTTPServer((host, base_port + offset if base_port else 0), FakeUpstreamHandler)
+            server.daemon_threads = True
+            server.upstream_name = name
+            server.settings = self.settings
+            server.asset_body = asset_body
+            self.servers[name] = server
+        self._threads: List[threading.Thread] = []
+
+    def upstream_hosts(self) -> str:
+        """生成 UPSTREAM_HOSTS 环境变量的值"""
+        return ','.join(
+            f'{name}=http://{server.server_address[0]}:{server.server_address[1]}'
+            for name, server in self.servers.items()
+        )
+
+    def start(self) -> 'FakeUpstream':
+        for server in self.servers.values():
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self) -> None:
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟上游')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--token-rate', type=float, default=50.0)
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--asset-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.host, args.port, UpstreamSettings(args.token_rate, args.tokens, args.asset_size))
+    upstream.start()
+    print(f'UPSTREAM_HOSTS={upstream.upstream_hosts()}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
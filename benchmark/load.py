@@ -0,0 +1,182 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+from benchmark.serve import BENCH_SHARE_TOKEN
+
+MODULEPRELOAD_PATTERN = re.compile(r'<link rel="modulepreload" href="([^"]+)"')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+class Recorder:
+    """记录单个场景下每个请求的耗时与失败数"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    def timed(self, session: requests.Session, method: str, url: str, **kwargs) -> Optional[requests.Response]:
+        start = time.perf_counter()
+        try:
+            resp = session.request(method, url, timeout=60, **kwargs)
+            _ = resp.content
+            self.record(time.perf_counter() - start, resp.status_code < 400)
+            return resp
+        except requests.RequestException:
+            self.record(time.perf_counter() - start, False)
+            return None
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class ProcessSampler:
+    """通过 /proc 采集被测进程的 CPU 时间与 RSS 峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._cpu_start = 0.0
+
+    def _cpu_seconds(self) -> float:
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        except (OSError, IndexError, ValueError):
+            return 0.0
+
+    def _rss_bytes(self) -> int:
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self._rss_bytes())
+
+    def __enter__(self) -> 'ProcessSampler':
+        self._cpu_start = self._cpu_seconds()
+        self.peak_rss = self._rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.cpu_seconds = self._cpu_seconds() - self._cpu_start
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    session.cookies.set('share_token', BENCH_SHARE_TOKEN)
+    return session
+
+
+def page_load(base_url: str, recorder: Recorder, session: requests.Session) -> None:
+    """首页加载：请求首页后依次拉取全部 modulepreload 资源"""
+    resp = recorder.timed(session, 'GET', base_url + '/')
+    if resp is None:
+        return
+    for href in MODULEPRELOAD_PATTERN.findall(resp.text):
+        recorder.timed(session, 'GET', href if href.startswith('http') else base_url + href)
+
+
+def chat(base_url: str, recorder: Recorder, session: requests.Session) -> None:
+    """一次完整的流式会话"""
+    recorder.timed(session, 'POST', base_url + '/backend-api/conversation', json={
+        'action': 'next',
+        'model': 'gpt-4o-mini',
+        'messages': [{'author': {'role': 'user'}, 'content': {'content_type': 'text', 'parts': ['hi']}}],
+    })
+
+
+def conversation_paging(base_url: str, recorder: Recorder, session: requests.Session) -> None:
+    """侧边栏会话列表翻页"""
+    for offset in range(0, 28 * 5, 28):
+        recorder.timed(session, 'GET', f'{base_url}/backend-api/conversations?offset={offset}&limit=28&order=updated')
+
+
+SCENARIOS: Dict[str, Callable[[str, Recorder, requests.Session], None]] = {
+    'page_load': page_load,
+    'chat': chat,
+    'conversation_paging': conversation_paging,
+}
+
+
+def run_scenario(name: str, base_url: str, pid: int, concurrency: int, duration: float) -> Dict:
+    """
+    以固定并发持续执行场景
+
+    Returns:
+        Dict: RPS、延迟分位数、CPU 与 RSS 统计
+    """
+    scenario = SCENARIOS[name]
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = _new_session()
+        while time.perf_counter() < deadline:
+            scenario(base_url, recorder, session)
+
+    with ProcessSampler(pid) as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+        elapsed = time.perf_counter() - start
+
+    count = len(recorder.latencies)
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': count,
+        'errors': recorder.errors,
+        'rps': round(count / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(recorder.latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(recorder.latencies, 99) * 1000, 2),
+        'cpu_pct': round(sampler.cpu_seconds / elapsed * 100, 1) if elapsed else 0.0,
+        'peak_rss_mb': round(sampler.peak_rss / 1024 / 1024, 1),
+    }
+
+
+def format_table(results: List[Dict]) -> str:
+    columns = ['mode', 'scenario', 'concurrency', 'requests', 'errors', 'rps', 'p50_ms', 'p99_ms', 'cpu_pct',
+               'peak_rss_mb']
+    widths = {c: max(len(c), *(len(str(r.get(c, ''))) for r in results)) for c in columns}
+    lines = ['  '.join(c.ljust(widths[c]) for c in columns)]
+    for result in results:
+        lines.append('  '.join(str(result.get(c, '')).ljust(widths[c]) for c in columns))
+    return '\n'.join(lines)
+
+
+def dump_json(results: List[Dict], path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
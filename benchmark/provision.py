@@ -0,0 +1,108 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+from benchmark.serve import ROOT, write_config
+
+
+def _items(count: int, round_no: int) -> List[Dict]:
+    return [{
+        'user_name': f'bulk-{i}',
+        'access_token': f'bulk-access-{round_no}-{i}',
+        'refresh_token': f'bulk-refresh-{round_no}-{i}',
+        'expire_at': int(time.time()) + 86400,
+    } for i in range(count)]
+
+
+def run_round(client, items: List[Dict], batch: int) -> Dict:
+    """分批调用 /api/share/bulk，返回吞吐与每一项的 share_token"""
+    share_tokens: List[str] = []
+    failed = 0
+    start = time.perf_counter()
+    for offset in range(0, len(items), batch):
+        resp = client.post('/api/share/bulk', json=items[offset:offset + batch])
+        for result in resp.get_json()['data']:
+            share_tokens.append(result['data'])
+            failed += not result['status']
+    seconds = time.perf_counter() - start
+    return {'shares': len(items), 'failed': failed, 'seconds': round(seconds, 3),
+            'shares_per_s': round(len(items) / seconds, 1), 'share_tokens': share_tokens}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark.provision', description='批量创建/替换分享的吞吐与正确性')
+    parser.add_argument('--shares', type=int, default=20000, help='每轮写入的分享数')
+    parser.add_argument('--batch', type=int, default=1000, help='每次 /api/share/bulk 请求的分享数')
+    parser.add_argument('--tracked', type=int, default=100000, help='预先登记后台刷新的其他分享数')
+    parser.add_argument('--min-ratio', type=float, default=0.5, help='替换轮吞吐低于首轮的该比例时以 1 退出')
+    parser.add_argument('--fake-redis', action='store_true', help='使用 fakeredis，否则连接 REDIS_HOST')
+    parser.add_argument('--json', help='结果额外写入 JSON 文件')
+    args = parser.parse_args()
+
+    os.environ['MIRROR_CONFIG'] = write_config(0, 'werkzeug')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import mirror
+    from utils import share_store
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.fake_redis:
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit('--fake-redis 需要安装 fakeredis: pip install "fakeredis[lua]"')
+        mirror.redis_utils.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    mirror.apply_config(mirror.Config())
+    redis_client = mirror.redis_utils.redis_client
+
+    # 已登记大量刷新任务时，替换旧分享的开销不应随登记数增长
+    for i in range(args.tracked):
+        mirror.token_manager.track(f'fk-tracked-{i}', '', f'tracked-refresh-{i}')
+
+    client = mirror.app.test_client()
+    created = run_round(client, _items(args.shares, 1), args.batch)
+    replaced = run_round(client, _items(args.shares, 2), args.batch)
+
+    failed = []
+    if created['failed'] or replaced['failed']:
+        failed.append(f"写入失败: 首轮 {created['failed']}，替换轮 {replaced['failed']}")
+    pipe = redis_client.pipeline(transaction=False)
+    for share_token in created['share_tokens']:
+        pipe.exists(share_store.SHARE_KEY + share_token)
+    leftover = sum(pipe.execute())
+    if leftover:
+        failed.append(f'{leftover} 个被替换的旧分享仍存在')
+    pipe = redis_client.pipeline(transaction=False)
+    for i in range(args.shares):
+        pipe.get(share_store.USER_KEY + f'bulk-{i}')
+    stale = sum(current != expected for current, expected in zip(pipe.execute(), replaced['share_tokens']))
+    if stale:
+        failed.append(f'{stale} 个 user_info 未指向新分享')
+    tracked = mirror.token_manager._tracked
+    old_tracked = sum(f'bulk-refresh-1-{i}' in tracked for i in range(args.shares))
+    new_tracked = sum(f'bulk-refresh-2-{i}' in tracked for i in range(args.shares))
+    if old_tracked or new_tracked != args.shares:
+        failed.append(f'刷新登记不一致: 旧 {old_tracked}，新 {new_tracked}/{args.shares}')
+    if replaced['shares_per_s'] < created['shares_per_s'] * args.min_ratio:
+        failed.append(f"替换轮吞吐 {replaced['shares_per_s']}/s 低于首轮 {created['shares_per_s']}/s 的 "
+                      f"{args.min_ratio:g} 倍")
+
+    result = {'tracked': args.tracked, 'batch': args.batch}
+    for name, data in (('create', created), ('replace', replaced)):
+        print(f"{name:<8} {data['shares']} shares  {data['seconds']:8.3f} s  {data['shares_per_s']:10.1f} shares/s")
+        result[name] = {k: v for k, v in data.items() if k != 'share_tokens'}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if failed:
+        print('FAILED\n  ' + '\n  '.join(failed))
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
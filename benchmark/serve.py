@@ -0,0 +1,78 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_SHARE_TOKEN = 'fk-benchmark000000'
+BENCH_USER = 'bench'
+BENCH_ACCESS_TOKEN = 'bench-access-token'
+
+
+def write_config(port: int, mode: str) -> str:
+    """生成压测用的配置文件，接口缓存的路由沿用仓库 config.yml"""
+    import yaml
+    with open(os.path.join(ROOT, 'config.yml'), encoding='utf-8') as f:
+        response_cache = (yaml.safe_load(f).get('mirror') or {}).get('response_cache') or {}
+    fd, path = tempfile.mkstemp(prefix='mirror-bench-', suffix='.yml')
+    with os.fdopen(fd, 'w') as f:
+        f.write(
+            'mirror:\n'
+            f'  port: {port}\n'
+            f'  server: {mode}\n'
+            # 压测的全部并发共用一个分享，不限制会话并发，测量的是代理本身的吞吐
+            '  concurrency:\n'
+            '    account_limit: 0\n'
+            '    share_limit: 0\n'
+            # WebSocket 中继检查的模拟上游在本机
+            '  websocket:\n'
+            '    allowed_hosts: ["127.0.0.1"]\n'
+            '  redirect_uri: "http://127.0.0.1"\n'
+            '  proxy: ""\n'
+            '  tls:\n'
+            '    enabled: false\n'
+        )
+        f.write(textwrap.indent(yaml.safe_dump({'response_cache': response_cache}, allow_unicode=True), '  '))
+    return path
+
+
+def seed(redis_utils) -> None:
+    from utils import share_store
+    share_store.save_share(redis_utils, BENCH_SHARE_TOKEN, {
+        'user_name': BENCH_USER,
+        'access_token': BENCH_ACCESS_TOKEN,
+    })
+    redis_utils.set_value('user_info:' + BENCH_USER, BENCH_SHARE_TOKEN)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='以压测配置启动 mirror')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--mode', default='werkzeug', help='werkzeug 或 hypercorn')
+    parser.add_argument('--fake-redis', action='store_true', help='使用进程内 fakeredis 代替本地 Redis')
+    args = parser.parse_args()
+
+    os.environ['MIRROR_CONFIG'] = write_config(args.port, args.mode)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+
+    import mirror
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    if args.fake_redis:
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit('--fake-redis 需要安装 fakeredis: pip install "fakeredis[lua]"')
+        mirror.redis_utils.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    seed(mirror.redis_utils)
+
+    mirror.main()
+
+
+if __name__ == '__main__':
+    main()
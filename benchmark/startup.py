@@ -0,0 +1,73 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from benchmark.serve import ROOT
+
+
+def run_check() -> Dict[str, float]:
+    """在新进程中执行 mirror.py --check，返回各阶段耗时（毫秒），wall 为含解释器启动的进程总耗时"""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, 'mirror.py', '--check', '--json'], cwd=ROOT,
+                          capture_output=True, text=True)
+    wall = (time.perf_counter() - start) * 1000
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{"phases_ms"')]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f'mirror.py --check 失败: {proc.stdout.strip() or proc.stderr.strip()}')
+    phases = json.loads(lines[-1])['phases_ms']
+    phases['wall'] = round(wall, 2)
+    return phases
+
+
+def slowest_imports(top: int) -> List[str]:
+    """-X importtime 下 mirror 直接导入的模块，按累计耗时排序"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import mirror'], cwd=ROOT,
+                          capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 名称前缩进两个空格的是 mirror 的直接依赖
+        if name.startswith('   ') and not name.startswith('    '):
+            rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return [f'{name:<40} {us / 1000:8.1f} ms' for us, name in rows[:top]]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark.startup', description='mirror 冷启动耗时')
+    parser.add_argument('--runs', type=int, default=5, help='重复启动次数，取中位数')
+    parser.add_argument('--max-ready-ms', type=float, help='ready 中位数超过该值时以 1 退出')
+    parser.add_argument('--max-wall-ms', type=float, help='进程总耗时中位数超过该值时以 1 退出')
+    parser.add_argument('--top', type=int, default=0, help='额外列出最慢的 N 个直接导入')
+    parser.add_argument('--json', help='结果额外写入 JSON 文件')
+    args = parser.parse_args()
+
+    runs = [run_check() for _ in range(args.runs)]
+    median = {name: round(statistics.median(run[name] for run in runs), 2) for name in runs[0]}
+    for name, value in median.items():
+        print(f'{name:<8} {value:8.1f} ms')
+    if args.top:
+        print()
+        print('\n'.join(slowest_imports(args.top)))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'median_ms': median, 'runs': runs}, f, indent=2)
+
+    failed = []
+    if args.max_ready_ms is not None and median['ready'] > args.max_ready_ms:
+        failed.append(f"ready {median['ready']} ms > {args.max_ready_ms} ms")
+    if args.max_wall_ms is not None and median['wall'] > args.max_wall_ms:
+        failed.append(f"wall {median['wall']} ms > {args.max_wall_ms} ms")
+    if failed:
+        print('FAILED ' + '; '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
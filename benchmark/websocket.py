@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import requests
+
+from benchmark.__main__ import _free_port, start_mirror
+from benchmark.load import ProcessSampler, percentile
+from benchmark.serve import BENCH_SHARE_TOKEN
+
+# 帧解析用例: (帧内容, 期望识别出的会话 ID)
+_SSE = 'data: {"type": "conversation_detail_metadata", "conversation_id": "c-sse"}\n\n'
+FRAME_CASES = [
+    (_SSE, ['c-sse']),
+    (json.dumps({'type': 'message', 'data': _SSE}), ['c-sse']),
+    (json.dumps({'type': 'message', 'data': {'body': base64.b64encode(_SSE.encode()).decode()}}), ['c-sse']),
+    (json.dumps({'data': {'type': 'conversation_detail_metadata', 'conversation_id': 'c-json'}}), ['c-json']),
+    (json.dumps({'type': 'message', 'data': {'body': base64.b64encode(b'data: {"type": "delta"}').decode()}}), []),
+    (json.dumps({'type': 'message', 'data': {'body': 'not base64!'}}), []),
+    ('{"type": "ack", "ackId": 1}', []),
+    ('data: [DONE]', []),
+]
+
+
+def check_frames() -> List[str]:
+    from utils.websocket_util import find_frame_conversation_ids
+    failed = []
+    for frame, expected in FRAME_CASES:
+        got = find_frame_conversation_ids(frame)
+        if got != expected:
+            failed.append(f'frame {frame[:60]!r}: {got} != {expected}')
+    return failed
+
+
+class WebSocketUpstream:
+    """本地模拟 chatgpt.com 的 register-websocket、会话推送通道与会话详情接口"""
+
+    def __init__(self):
+        self.port = _free_port()
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._counter = 0
+
+    def upstream_hosts(self) -> str:
+        return f'chatgpt.com=http://127.0.0.1:{self.port}'
+
+    async def _register(self, request):
+        from aiohttp import web
+        return web.json_response({
+            'wss_url': f'ws://127.0.0.1:{self.port}/client/hubs/conversations?access_token=bench',
+            'expires_at': '2099-01-01T00:00:00Z',
+        })
+
+    async def _hub(self, request):
+        import aiohttp
+        from aiohttp import web
+        ws = web.WebSocketResponse(protocols=('json.reliable.webpubsub.azure.v1',))
+        await ws.prepare(request)
+        self._counter += 1
+        # 与线上相同，SSE 以 base64 放在 body 字段中推送
+        sse = f'data: {{"type": "conversation_detail_metadata", "conversation_id": "ws-{self._counter}"}}\n\n'
+        await ws.send_str(json.dumps({'type': 'message', 'data': {'body': base64.b64encode(sse.encode()).decode()}}))
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                await ws.send_str(msg.data)
+        return ws
+
+    async def _conversation(self, request):
+        from aiohttp import web
+        return web.json_response({'conversation_id': request.match_info['cid'], 'mapping': {}})
+
+    def _run(self) -> None:
+        from aiohttp import web
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_post('/backend-api/register-websocket', self._register)
+        app.router.add_get('/client/hubs/conversations', self._hub)
+        app.router.add_get('/backend-api/conversation/{cid}', self._conversation)
+        runner = web.AppRunner(app)
+        self._loop.run_until_complete(runner.setup())
+        self._loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', self.port).start())
+        self._ready.set()
+        self._loop.run_forever()
+
+    def start(self) -> 'WebSocketUpstream':
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def _metric(text: str, name: str, **labels) -> float:
+    selector = ','.join(f'{k}="{v}"' for k, v in labels.items())
+    pattern = re.escape(f'{name}{{{selector}}}' if labels else name) + r' ([0-9.e+-]+)'
+    match = re.search(pattern, text)
+    return float(match.group(1)) if match else 0.0
+
+
+def _threads(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+async def check_relay(base_url: str, admin_token: str) -> List[str]:
+    """鉴权、白名单、上游不可达均在握手前以 403 拒绝；中继回显并登记推送的会话归属"""
+    import aiohttp
+    failed = []
+    cookie = {'Cookie': f'share_token={BENCH_SHARE_TOKEN}'}
+    ws_base = 'ws' + base_url[4:]
+    resp = requests.post(f'{base_url}/backend-api/register-websocket', json={}, headers=cookie, timeout=10)
+    wss_url = resp.json().get('wss_url', '')
+    if '/ws-relay?target=' not in wss_url:
+        return [f'register-websocket 未改写为中继地址: {wss_url}']
+
+    rejects = {
+        'unauthorized': (wss_url, {}),
+        'forbidden': (f'{ws_base}/ws-relay?target=wss%3A%2F%2Fevil.example%2Fhub', cookie),
+        'upstream_error': (f'{ws_base}/ws-relay?target=ws%3A%2F%2F127.0.0.1%3A{_free_port()}%2Fhub', cookie),
+    }
+    async with aiohttp.ClientSession() as session:
+        for name, (url, headers) in rejects.items():
+            try:
+                ws = await session.ws_connect(url, headers=headers)
+                await ws.close()
+                failed.append(f'{name}: 握手未被拒绝')
+            except aiohttp.WSServerHandshakeError as e:
+                if e.status != 403:
+                    failed.append(f'{name}: 握手返回 {e.status}，期望 403')
+
+        ws = await session.ws_connect(wss_url, headers=cookie, protocols=('json.reliable.webpubsub.azure.v1',))
+        if ws.protocol != 'json.reliable.webpubsub.azure.v1':
+            failed.append(f'子协议未透传: {ws.protocol}')
+        first = await ws.receive(timeout=5)
+        await ws.send_str('ping')
+        echo = await ws.receive(timeout=5)
+        if echo.data != 'ping':
+            failed.append(f'回显不一致: {echo.data!r}')
+        await ws.close()
+    # 归属经异步写入队列登记，未登记时会话详情返回 401
+    owned = requests.get(f'{base_url}/backend-api/conversation/ws-1', headers=cookie, timeout=10)
+    if owned.status_code != 200:
+        failed.append(f'中继推送的会话未登记归属: {owned.status_code} {first.data[:80]!r}')
+    foreign = requests.get(f'{base_url}/backend-api/conversation/not-mine', headers=cookie, timeout=10)
+    if foreign.status_code != 401:
+        failed.append(f'未登记的会话返回 {foreign.status_code}，期望 401')
+
+    metrics = requests.get(f'{base_url}/metrics', headers={'X-Admin-Token': admin_token}, timeout=10).text
+    rejected = _metric(metrics, 'mirror_requests_total', route='websocket', status='403')
+    accepted = _metric(metrics, 'mirror_requests_total', route='websocket', status='101')
+    if rejected != len(rejects) or accepted != 1:
+        failed.append(f'指标与客户端所见不一致: 403={rejected:g} 101={accepted:g}')
+    if 'route="websocket",status="502"' in metrics:
+        failed.append('指标中仍有 websocket 502')
+    return failed
+
+
+async def hold_sockets(base_url: str, pid: int, sockets: int, concurrency: int) -> Dict:
+    """同时保持大量空闲中继连接，统计握手与回显延迟以及 mirror 的 RSS 与线程数"""
+    import aiohttp
+    cookie = {'Cookie': f'share_token={BENCH_SHARE_TOKEN}'}
+    wss_url = requests.post(f'{base_url}/backend-api/register-websocket', json={}, headers=cookie,
+                            timeout=10).json()['wss_url']
+    threads_before = _threads(pid)
+    semaphore = asyncio.Semaphore(concurrency)
+    handshakes: List[float] = []
+    echoes: List[float] = []
+
+    with ProcessSampler(pid) as sampler:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            async def connect():
+                async with semaphore:
+                    start = time.perf_counter()
+                    ws = await session.ws_connect(wss_url, headers=cookie)
+                    handshakes.append(time.perf_counter() - start)
+                    await ws.receive(timeout=10)
+                    return ws
+
+            conns = await asyncio.gather(*(connect() for _ in range(sockets)))
+            threads_held = _threads(pid)
+            metrics = requests.get(f'{base_url}/metrics', headers={'X-Admin-Token': os.environ['ADMIN_TOKEN']},
+                                   timeout=10).text
+            in_flight = _metric(metrics, 'mirror_websockets_in_flight')
+
+            async def echo(ws):
+                start = time.perf_counter()
+                await ws.send_str('x')
+                await ws.receive(timeout=10)
+                echoes.append(time.perf_counter() - start)
+
+            await asyncio.gather(*(echo(ws) for ws in conns))
+            await asyncio.gather(*(ws.close() for ws in conns))
+    return {
+        'sockets': sockets,
+        'in_flight': int(in_flight),
+        'handshake_p50_ms': round(percentile(handshakes, 50) * 1000, 1),
+        'handshake_p99_ms': round(percentile(handshakes, 99) * 1000, 1),
+        'echo_p50_ms': round(percentile(echoes, 50) * 1000, 1),
+        'echo_p99_ms': round(percentile(echoes, 99) * 1000, 1),
+        'threads': f'{threads_before}->{threads_held}',
+        'peak_rss_mb': round(sampler.peak_rss / 1024 / 1024, 1),
+        'cpu_s': round(sampler.cpu_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark.websocket', description='WebSocket 中继检查与空闲连接压测')
+    parser.add_argument('--sockets', type=int, default=500, help='同时保持的空闲中继连接数，0 只做检查')
+    parser.add_argument('--concurrency', type=int, default=50, help='并发握手数')
+    parser.add_argument('--fake-redis', action='store_true', help='使用 fakeredis，否则连接 REDIS_HOST')
+    parser.add_argument('--json', help='结果额外写入 JSON 文件')
+    args = parser.parse_args()
+
+    failed = check_frames()
+    # 读取 /metrics 需要管理员 token
+    os.environ.setdefault('ADMIN_TOKEN', 'benchmark-admin')
+    upstream = WebSocketUpstream().start()
+    result = None
+    try:
+        proc, port = start_mirror('hypercorn', upstream, args.fake_redis)
+        try:
+            base_url = f'http://127.0.0.1:{port}'
+            failed += asyncio.run(check_relay(base_url, os.environ['ADMIN_TOKEN']))
+            if args.sockets > 0:
+                result = asyncio.run(hold_sockets(base_url, proc.pid, args.sockets, args.concurrency))
+                if result['in_flight'] != args.sockets:
+                    failed.append(f"mirror_websockets_in_flight={result['in_flight']}，期望 {args.sockets}")
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+    finally:
+        upstream.stop()
+
+    if result is not None:
+        for name, value in result.items():
+            print(f'{name:<18} {value}')
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(result, f, indent=2)
+    if failed:
+        print('FAILED\n  ' + '\n  '.join(failed))
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,14 @@
-import os
+import logging
 
 import requests
 from typing import Dict, List, Optional
 from http.cookies import SimpleCookie
 import json
 
+from utils.egress_util import egress_pool
+
+logger = logging.getLogger(__name__)
+
 
 class CloudflareSession:
     def __init__(self):
@@ -42,7 +46,7 @@ class CloudflareSession:
                 cookie_data = self.parse_set_cookie(set_cookie)
                 cookies.append(cookie_data)
             except Exception as e:
-                print(f"Error parsing cookie: {str(e)}")
+                logger.warning("Error parsing cookie: %s", e)
 
         return cookies
 
@@ -90,7 +94,7 @@ class CloudflareSession:
             return result
 
         except Exception as e:
-            print(f"Error getting Cloudflare cookies: {str(e)}")
+            logger.error("Error getting Cloudflare cookies: %s", e)
             return None
 
 
@@ -98,7 +102,8 @@ def test_cookies():
     cf_session = CloudflareSession()
 
     # 使用代理（可选）
-    proxy = os.getenv("PROXY", None)
+    egress = egress_pool.select()
+    proxy = egress.url if egress is not None else None
 
     result = cf_session.get_cloudflare_cookies(
         url="https://chatgpt.com",
@@ -113,9 +118,7 @@ def test_cookies():
             cf_cookies = [c for c in result["exist_data_list"][0]["cookies"]
                           if c["name"] in ["cf_clearance", "__cf_bm"]]
             if cf_cookies:
-                print("\nFound Cloudflare cookies!")
-                for cookie in cf_cookies:
-                    print(f"  {cookie['name']}: {cookie['value']}")
+                logger.info("Found Cloudflare cookies: %s", [cookie['name'] for cookie in cf_cookies])
         return json.dumps(result, indent=2)
 
 
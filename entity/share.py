@@ -7,6 +7,8 @@ class Share:
 
     access_token: str = field(default="")
 
+    refresh_token: str = field(default="")
+
     gpt_4_limit: int = -1
     gpt_4o_limit: int = -1
     gpt_4o_mini_limit: int = -1
@@ -1,58 +1,181 @@
+import time
+
+# 启动计时起点，--check 时输出各阶段耗时
+_import_start = time.perf_counter()
+
+import argparse
+import hashlib
 import json
 import logging
 import os
-import re
 import ssl
-import traceback
+import sys
+import threading
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Tuple, Union
 from urllib.parse import urlparse
-import cloudscraper
 
-
-# import requests
-import yaml
-from flask import Flask, request, Response, render_template, make_response, redirect
+from requests import RequestException
+from flask import Flask, request, Response, render_template, make_response, redirect, g
 
 import models
 from entity.CloudFlareSession import test_cookies
 from entity.share import Share
+from utils import metrics_util, profile_util, share_store
+from utils.admission_util import AdmissionController
+from utils.cache_util import CachedResponse, ResponseCache, STALE
+from utils.egress_util import egress_pool, is_egress_failure, parse_proxies
+from utils.lifecycle_util import Lifecycle
+from utils.log_util import log_event, setup_logging
 from utils.common_util import build_url, build_target_url, need_auth, stream_response, body_need_handle, \
-    modify_response_body
-from utils.redis_util import RedisUtils
-from utils.token_util import access_to_share, check_access_token
+    modify_response_body, route_class
+from utils.quota_util import QuotaEngine
+from utils.redis_util import RedisUtils, WriteBehind
+from utils.scheduler_util import SchedulerRejected, StreamScheduler
+from utils.token_manager import TokenManager
+from utils.token_util import access_to_share
 
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+setup_logging()
+logger = logging.getLogger(__name__)
 
-scraper = cloudscraper.create_scraper()
+# cloudscraper 依赖较多，在初始化阶段或首次请求时创建
+scraper = None
+_scraper_lock = threading.Lock()
 
+# 只保存连接参数，客户端在初始化阶段或首次使用时创建
 redis_utils = RedisUtils(
     host=os.getenv('REDIS_HOST', '127.0.0.1'),
     port=int(os.getenv('REDIS_PORT', 6379))
 )
 
+token_manager = TokenManager(redis_utils)
+quota_engine = QuotaEngine(redis_utils)
+stream_scheduler = StreamScheduler(redis_utils)
+housekeeper = share_store.Housekeeper(redis_utils)
+# 会话归属等非关键写入异步批量提交，停机时刷新
+write_behind = WriteBehind(redis_utils)
+lifecycle = Lifecycle()
+
+# 过载保护，满载时优先丢弃静态资源与列表翻页
+admission = AdmissionController()
+# 停机排空按所有请求计数，批量写入等接口也会等待完成
+app.wsgi_app = admission.track(app.wsgi_app)
+
+# 账号级只读接口的共享缓存，routes 为 路径前缀 -> TTL(秒)，由 apply_config 读取 config.yml 的 response_cache.routes
+response_cache = ResponseCache('response')
+response_cache_routes: Dict[str, float] = {}
+response_cache_stale = 30
+
+# 会话列表按 (账号, 用户, 分页参数) 缓存过滤后的结果，账号有新会话或会话被修改时失效
+conversation_cache = ResponseCache('conversations', max_bytes=8 * 1024 * 1024)
+conversation_cache_ttl = 30
+
+# WebSocket 中继，仅 server: hypercorn 时创建，register-websocket 返回的 wss_url 改写为经由中继
+websocket_relay = None
+
+# 透传给客户端的上游响应头
+RESPONSE_HEADERS = ['Content-Type', 'Cache-Control', 'Expires']
+
 cf_cookie = []
 user_agent_map = {}
 
+metrics_util.REDIS_POOL_CONNECTIONS.set_function(
+    lambda: {(state,): value for state, value in redis_utils.pool_stats().items()}
+)
+
+
+def get_scraper():
+    global scraper
+    if scraper is None:
+        with _scraper_lock:
+            if scraper is None:
+                import cloudscraper
+                scraper = cloudscraper.create_scraper()
+    return scraper
+
 
 class Config:
-    def __init__(self, config_path: str = "config.yml"):
+    def __init__(self, config_path: str = os.getenv("MIRROR_CONFIG", "config.yml")):
+        import yaml
         with open(config_path) as f:
             config = yaml.safe_load(f)
         self.tls = config['mirror'].get('tls', {})
         self.tls_enabled = self.tls.get('enabled', False)
         self.tls_cert = self.tls.get('cert')
         self.tls_key = self.tls.get('key')
-        self.proxy = self.tls.get('proxy')
+        self.tls_ciphers = self.tls.get('ciphers')
+        self.tls_session_tickets = self.tls.get('session_tickets', 2)
+        self.server = config['mirror'].get('server', 'werkzeug')
+        self.proxy = parse_proxies(config['mirror'].get('proxy') or self.tls.get('proxy'))
         self.port = config['mirror']['port']
         self.redirect_uri = config['mirror']['redirect_uri']
+        self.quota_window = config['mirror'].get('quota_window', 10800)
+        self.concurrency = config['mirror'].get('concurrency', {})
+        self.response_cache = config['mirror'].get('response_cache', {})
+        self.conversation_cache = config['mirror'].get('conversation_cache', {})
+        self.admission = config['mirror'].get('admission', {})
+        self.shutdown = config['mirror'].get('shutdown', {})
+        self.websocket = config['mirror'].get('websocket', {})
+
+
+# 携带追踪头时记录本次请求各阶段耗时
+@app.before_request
+def start_trace():
+    if profile_util.is_admin(request.headers.get(profile_util.TRACE_HEADER)):
+        g.trace_start = time.perf_counter()
+        metrics_util.start_trace()
+
+
+# 按路由类别和状态码计数
+@app.after_request
+def count_request(response):
+    metrics_util.REQUESTS_TOTAL.labels(route_class(request.path), response.status_code).inc()
+    if 'trace_start' in g:
+        stages = metrics_util.finish_trace()
+        stages.append(('total', time.perf_counter() - g.trace_start))
+        response.headers['Server-Timing'] = profile_util.server_timing(stages)
+    return response
+
+
+@app.teardown_request
+def finish_trace(exc=None):
+    metrics_util.finish_trace()
+
+
+# 采样分析接口，返回 folded stacks
+@app.route('/api/admin/profile', methods=['GET'])
+def api_admin_profile():
+    if not profile_util.is_admin(request.headers.get(profile_util.ADMIN_HEADER)):
+        return '', 404
+    seconds = request.args.get('seconds', 10, type=float)
+    interval = request.args.get('interval_ms', 5, type=float) / 1000
+    profile = profile_util.sample_stacks(seconds, max(interval, 0.001))
+    if profile is None:
+        return 'profile already running', 409
+    return Response(profile, mimetype='text/plain')
+
+
+# 指标接口，含各路由延迟与并发，与管理接口一样需要 ADMIN_TOKEN
+# Prometheus 可用 authorization.credentials 以 Bearer 方式携带
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    token = request.headers.get(profile_util.ADMIN_HEADER)
+    authorization = request.headers.get('Authorization', '')
+    if token is None and authorization.startswith('Bearer '):
+        token = authorization[7:]
+    if not profile_util.is_admin(token):
+        return '', 404
+    return Response(metrics_util.REGISTRY.render(), mimetype=metrics_util.CONTENT_TYPE)
 
 
 # 账号信息接口
 @app.route('/api/check', methods=['GET'])
+@admission.guard
 def api_check():
     m_token = request.args.get("m_token", None)
     if m_token is not None:
-        resp = check_access_token(m_token)
+        resp = token_manager.check(m_token)
         response = Response(
             response=resp.content,
             status=resp.status_code
@@ -87,7 +210,7 @@ def api_free_login():
 
     # 不为空，获取at并校验
     if share_token is not None:
-        access_token = redis_utils.hash_get('share_token_info:' + share_token, 'access_token')
+        access_token = share_store.get_share_field(redis_utils, share_token, 'access_token')
         # at为空，返回
         if access_token is None:
             redirect_path = redirect(config.redirect_uri)
@@ -113,35 +236,94 @@ def api_free_login():
 
 
 # 生成share_token
+def provision(shares: List[Share]) -> List[Union[str, Exception]]:
+    """生成 share_token 并写入分享，同一用户的旧分享在同一原子操作中删除；返回 share_token，写入失败的为异常"""
+    share_tokens = [access_to_share(share) for share in shares]
+    formers = share_store.provision_shares(
+        redis_utils, [(token, asdict(share)) for token, share in zip(share_tokens, shares)])
+    results: List[Union[str, Exception]] = []
+    for share_token, share, former_share_token in zip(share_tokens, shares, formers):
+        if isinstance(former_share_token, Exception):
+            results.append(former_share_token)
+            continue
+        if former_share_token is not None and former_share_token != share_token:
+            token_manager.untrack(former_share_token)
+        # 带 refresh_token 的分享由后台定时刷新 access_token
+        token_manager.track(share_token, share.access_token, share.refresh_token)
+        results.append(share_token)
+    return results
+
+
+def parse_share(item: Any) -> Share:
+    if not isinstance(item, dict):
+        raise ValueError('分享信息格式错误')
+    share = Share(**item)
+    if not share.user_name or not share.access_token:
+        raise ValueError('user_name 与 access_token 不能为空')
+    return share
+
+
 @app.route('/api/share', methods=['POST'])
+@admission.guard
 def api_share():
-    share_info = request.get_json(silent=True)
-    # 转换为实体类
-    share = Share(**share_info)
+    try:
+        share = parse_share(request.get_json(silent=True))
+    except (TypeError, ValueError) as e:
+        return {'status': False, 'message': str(e), 'data': None}, 400
     # resp = check_access_token(share.access_token)
     # 校验token状态，不通过直接返回false
     # if resp.status_code != 200:
     #     response = {'status': False, 'message': '无效的 access token', 'data': None}
     #     return response
 
-    # 生成share_token
-    share_token = access_to_share(share)
-
-    # 检查原有用户信息,如果存在需要删除
-    former_share_token = redis_utils.get_value('user_info:' + share.user_name)
-    if former_share_token is not None:
-        redis_utils.delete_keys("share_token_info:" + former_share_token)
-    # 将share_token存入redis
-    redis_utils.hash_set("share_token_info:" + share_token, share_info)
-    # 将用户信息存入redis
-    redis_utils.set_value("user_info:" + share.user_name, share_token)
+    share_token = provision([share])[0]
+    if isinstance(share_token, Exception):
+        return {'status': False, 'message': '写入失败', 'data': None}, 500
 
     # 返回share_token
     response = {'status': True, 'message': 'Success', 'data': share_token}
-    print("生成的share_token: ", share_token)
+    log_event(logger, 'share_created', user_name=share.user_name)
     return response
 
 
+@app.route('/api/share/bulk', methods=['POST'])
+@admission.guard
+def api_share_bulk():
+    """批量创建分享，请求体为 Share 列表，按原顺序返回每一项的结果"""
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return {'status': False, 'message': '请求体应为分享列表', 'data': None}, 400
+
+    results: List[Dict[str, Any]] = [None] * len(items)
+    valid: List[Tuple[int, Share]] = []
+    user_names = set()
+    for index, item in enumerate(items):
+        try:
+            share = parse_share(item)
+        except (TypeError, ValueError) as e:
+            results[index] = {'status': False, 'message': str(e), 'data': None}
+            continue
+        # 同一用户只保留一个分享，后写入的会删除先写入的
+        if share.user_name in user_names:
+            results[index] = {'status': False, 'message': 'user_name 在本次请求中重复', 'data': None}
+            continue
+        user_names.add(share.user_name)
+        valid.append((index, share))
+
+    created = 0
+    for (index, _), share_token in zip(valid, provision([share for _, share in valid])):
+        if isinstance(share_token, Exception):
+            results[index] = {'status': False, 'message': '写入失败', 'data': None}
+        else:
+            results[index] = {'status': True, 'message': 'Success', 'data': share_token}
+            created += 1
+
+    log_event(logger, 'share_bulk_created', total=len(items), created=created)
+    if created < len(valid):
+        return {'status': False, 'message': '部分写入失败', 'data': results}, 500
+    return {'status': True, 'message': 'Success', 'data': results}
+
+
 # 处理登出
 @app.route('/backend-api/accounts/logout_all', methods=['POST'])
 def handle_logout():
@@ -163,16 +345,12 @@ def handle_index(path: str = None):
 
 
 @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
+@admission.guard
 def proxy(path: str):
-    access_token = request.headers.get('Authorization')
     share_token = request.cookies.get("share_token")
-    if access_token is not None and access_token.startswith("Bearer "):
-        access_token = access_token.replace("Bearer ", "")
-    elif access_token is None and share_token is not None:
-        access_token = redis_utils.hash_get("share_token_info:" + share_token, 'access_token')
-        if access_token is None:
-            return '', 401
-    else:
+    with metrics_util.stage('auth'):
+        access_token, share_info = resolve_auth(request.headers.get('Authorization'), share_token)
+    if access_token is None:
         return '', 401
 
     source_url = build_url(request)
@@ -203,65 +381,112 @@ def proxy(path: str):
             # 重定向
             return '', 401
 
-    # Forward the request
-    px = {
-        'http': os.getenv("PROXY", ""),
-        'https': os.getenv("PROXY", "")
-    }
+    if path == 'backend-api/conversations' and request.method == 'GET':
+        username = resolve_username(share_info, share_token)
+        return cached_conversations(target_url, headers, access_token, share_token, username)
+
+    # 同一账号的只读接口直接使用共享缓存
+    cache_ttl = response_cache_ttl(path) if request.method == 'GET' else None
+    if cache_ttl is not None:
+        return cached_proxy(path, target_url, headers, access_token, share_token, cache_ttl)
+
+    # 会话请求在建立上游连接前校验分享额度，请求未到达上游时退还
+    stream = path == 'backend-api/conversation'
+    model = None
+    if share_info and stream and request.method == 'POST':
+        model = (request.get_json(silent=True) or {}).get('model')
+        with metrics_util.stage('quota'):
+            rejection = quota_engine.check(share_token, share_info, model)
+        if rejection is not None:
+            return {'detail': rejection[1]}, rejection[0]
+
+    # 会话流按账号/分享限制并发，超出部分公平排队
+    slot = None
+    if stream:
+        try:
+            with metrics_util.stage('schedule'):
+                slot = stream_scheduler.acquire(access_token, share_token)
+        except SchedulerRejected as e:
+            if model is not None:
+                quota_engine.refund(share_token, share_info, model)
+            return {'detail': e.detail}, e.status, {'Retry-After': str(e.retry_after)}
+
+    # Forward the request，同一 share_token 固定走同一出口
+    egress = egress_pool.select(share_token)
+    upstream_start = time.perf_counter()
+    lease = egress_pool.lease(egress)
+    resp = None
     try:
-        resp = scraper.request(
+        resp = get_scraper().request(
             method=request.method,
             url=target_url,
             headers=headers,
             data=request.get_data(),
-            stream=True if path == 'backend-api/conversation' else False,  # 只在会话API时使用流式传输
+            stream=stream,  # 只在会话API时使用流式传输
             allow_redirects=False,
-            proxies=px
+            proxies=egress_pool.proxies(egress)
 
         )
-        print(headers)
-    except scraper.RequestException as e:
-        traceback.print_exc()
+        log_event(logger, 'upstream_request', logging.DEBUG, sample=0.01,
+                  method=request.method, path=path, headers=headers)
+    except RequestException as e:
+        egress_pool.report(egress, time.perf_counter() - upstream_start, False)
+        if slot is not None:
+            slot.release()
+        if model is not None:
+            quota_engine.refund(share_token, share_info, model)
+        logger.exception("Upstream request failed: %s", target_url)
         return str(e), 500
-
-    share_token = request.cookies.get("share_token")
-    username = redis_utils.hash_get("share_token_info:" + share_token, 'user_name') if share_token is not None else ''
-    # conversation 接口采取流式输出
+    finally:
+        # 会话流在上游读完后才释放出口，长连接同样计入出口并发
+        if not stream or resp is None:
+            lease.release()
+    # elapsed 为发送请求到解析完响应头的耗时(含建连)，非流式请求剩余部分为读取响应体
+    ttfb = resp.elapsed.total_seconds()
+    egress_pool.report(egress, ttfb, not is_egress_failure(resp.status_code))
+    metrics_util.observe_stage('upstream_ttfb', ttfb)
+    if not stream:
+        metrics_util.observe_stage('upstream_body', max(time.perf_counter() - upstream_start - ttfb, 0.0))
+
+    username = resolve_username(share_info, share_token)
+    # conversation 接口采取流式输出，识别到会话 ID 时登记归属
     if path == 'backend-api/conversation':
-        data = stream_response(username, resp, redis_utils)
-        # 使用正则表达式匹配具有特定格式的 JSON
-        json_pattern = re.compile(r'{"type": "conversation_detail_metadata".*?}')
-
-        # 查找匹配的 JSON
-        match = json_pattern.search(str(data.get_data()))
-        if match:
-            json_str = match.group(0)
-            try:
-                json_data = json.loads(json_str)
-                # 这里处理找到的 JSON 数据
-                # 可以访问具体字段
-                conversation_id = json_data.get('conversation_id')
-                # redis_utils.set_value(f'conversation_metadata:{conversation_id}', json_data)
-                redis_utils.set_add('user_conversations:' + username, conversation_id)
-            except json.JSONDecodeError:
-                pass
+        def finish():
+            lease.release()
+            slot.release()
+
+        # 读完即释放名额与出口，避免客户端收到结束块后立即发起的下一次会话被误判超限
+        data = stream_response(resp, lambda conversation_id: own_conversation(username, access_token, conversation_id),
+                               finish)
+        data.call_on_close(finish)
         return data
     if path.startswith('backend-api/conversation/') and path.find('init') == -1:
         cur_conversation = path.split("/")[2]
         cur_user_conversations = redis_utils.set_members('user_conversations:' + username)
+        # 归属可能仍在异步写入队列中
+        if cur_conversation not in (cur_user_conversations or []) and write_behind.pending():
+            write_behind.flush(1)
+            cur_user_conversations = redis_utils.set_members('user_conversations:' + username)
         # 判断cur_conversation是否在用户对话列表中
         if cur_user_conversations is None or cur_conversation not in cur_user_conversations:
             return '', 401
+        # 重命名、删除等修改会改变会话列表
+        if request.method != 'GET' and resp.status_code < 400:
+            invalidate_conversations(access_token)
+    # 会话的 WebSocket 通道改为连接本地中继
+    if path == 'backend-api/register-websocket' and websocket_relay is not None and resp.status_code == 200:
+        return relay_register_websocket(resp)
 
     # 处理响应
     response_headers = {}
-    for header in ['Content-Type', 'Cache-Control', 'Expires']:
+    for header in RESPONSE_HEADERS:
         if header in resp.headers:
             response_headers[header] = resp.headers[header]
 
     # 对于静态文件和需要处理的响应
     if body_need_handle(target_url):
-        modified_content = modify_response_body(resp, redis_utils)
+        with metrics_util.stage('rewrite'):
+            modified_content = modify_response_body(resp, redis_utils)
         response = Response(
             response=modified_content,
             status=resp.status_code,
@@ -278,24 +503,307 @@ def proxy(path: str):
     return response
 
 
-def main():
-    global config
-    config = Config()
-
-    if config.tls_enabled:
-        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        ssl_context.load_cert_chain(config.tls_cert, config.tls_key)
-        app.run(
-            host="0.0.0.0",
-            port=config.port,
-            ssl_context=ssl_context
+def resolve_auth(authorization: Optional[str], share_token: Optional[str]) -> Tuple[Optional[str], dict]:
+    """
+    解析请求使用的账号，Authorization 头优先，其次为 share_token 对应的分享
+
+    Returns:
+        Tuple[Optional[str], dict]: (access_token, 分享信息)，无法鉴权时 access_token 为 None
+    """
+    if authorization is not None and authorization.startswith("Bearer "):
+        return authorization.replace("Bearer ", ""), {}
+    if authorization is None and share_token is not None:
+        # 一次读取完整分享信息，供额度校验与用户名复用
+        share_info = share_store.get_share(redis_utils, share_token) or {}
+        return share_info.get('access_token'), share_info
+    return None, {}
+
+
+def resolve_websocket_auth(authorization: Optional[str], share_token: Optional[str]) -> Tuple[Optional[str], str]:
+    access_token, share_info = resolve_auth(authorization, share_token)
+    return access_token, resolve_username(share_info, share_token) if access_token else ''
+
+
+def own_conversation(username: str, access_token: str, conversation_id: str) -> None:
+    """登记会话归属，账号的会话列表缓存随之失效"""
+    write_behind.set_add(share_store.CONVERSATIONS_KEY + username, conversation_id)
+    invalidate_conversations(access_token)
+
+
+def relay_register_websocket(resp) -> Response:
+    from utils.websocket_util import relay_url
+    try:
+        body = resp.json()
+    except ValueError:
+        body = None
+    if isinstance(body, dict) and body.get('wss_url'):
+        # 前置 nginx 终止 TLS 时页面为 https，中继地址须为 wss
+        secure = request.is_secure or request.headers.get('X-Forwarded-Proto') == 'https'
+        body['wss_url'] = relay_url(body['wss_url'], secure, request.host)
+        return Response(json.dumps(body), status=resp.status_code, content_type='application/json')
+    return Response(resp.content, status=resp.status_code, content_type=resp.headers.get('Content-Type'))
+
+
+def resolve_username(share_info: dict, share_token: str) -> str:
+    if share_info:
+        return share_info.get('user_name', '')
+    return share_store.get_share_field(redis_utils, share_token, 'user_name') if share_token is not None else ''
+
+
+def invalidate_conversations(access_token: str) -> None:
+    """账号下任一用户的会话变化都会改变上游列表，按账号失效，回源中的结果也不再写入"""
+    conversation_cache.invalidate(lambda key: key[0] == access_token, group=access_token)
+
+
+def cached_conversations(target_url: str, headers: dict, access_token: str, share_token: str, username: str):
+    # offset/limit 等分页参数原样转发，每页单独缓存
+    query = request.query_string.decode('latin-1')
+    if query:
+        target_url += '?' + query
+    key = (access_token, username, query)
+    entry, state = conversation_cache.get(key)
+    if entry is None:
+        generation = conversation_cache.begin_fill(access_token)
+        cacheable = None
+        try:
+            # 新会话的归属可能仍在异步写入队列中，先写入再过滤，避免缓存到被锁定的标题
+            if write_behind.pending():
+                write_behind.flush(1)
+            entry = fetch_cacheable(target_url, headers, share_token)
+            if entry.status == 200:
+                entry.headers['ETag'] = '"' + hashlib.blake2b(entry.body, digest_size=16).hexdigest() + '"'
+                # 浏览器保存响应但每次都带 If-None-Match 重新验证
+                entry.headers['Cache-Control'] = 'private, no-cache'
+                cacheable = entry
+        except RequestException as e:
+            logger.exception("Upstream request failed: %s", target_url)
+            return str(e), 500
+        finally:
+            conversation_cache.end_fill(access_token, generation, key, cacheable, conversation_cache_ttl)
+    etag = entry.headers.get('ETag')
+    if etag is not None and request.if_none_match.contains_weak(etag.strip('"')):
+        return Response(status=304, headers={'ETag': etag, 'Cache-Control': entry.headers['Cache-Control'],
+                                             'X-Mirror-Cache': state})
+    return Response(
+        response=entry.body,
+        status=entry.status,
+        headers={**entry.headers, 'X-Mirror-Cache': state}
+    )
+
+
+def response_cache_ttl(path: str):
+    for prefix, ttl in response_cache_routes.items():
+        if path == prefix or path.startswith(prefix + '/'):
+            return ttl
+    return None
+
+
+def fetch_cacheable(target_url: str, headers: dict, egress_key: str = None) -> CachedResponse:
+    """请求上游并完成响应体改写，结果可直接放入缓存"""
+    egress = egress_pool.select(egress_key)
+    upstream_start = time.perf_counter()
+    egress_pool.acquire(egress)
+    try:
+        resp = get_scraper().request(
+            method='GET',
+            url=target_url,
+            headers=headers,
+            allow_redirects=False,
+            proxies=egress_pool.proxies(egress)
         )
+    except RequestException:
+        egress_pool.report(egress, time.perf_counter() - upstream_start, False)
+        raise
+    finally:
+        egress_pool.release(egress)
+    ttfb = resp.elapsed.total_seconds()
+    egress_pool.report(egress, ttfb, not is_egress_failure(resp.status_code))
+    metrics_util.observe_stage('upstream_ttfb', ttfb)
+    metrics_util.observe_stage('upstream_body', max(time.perf_counter() - upstream_start - ttfb, 0.0))
+
+    response_headers = {h: resp.headers[h] for h in RESPONSE_HEADERS if h in resp.headers}
+    if body_need_handle(target_url):
+        with metrics_util.stage('rewrite'):
+            content = modify_response_body(resp, redis_utils)
     else:
-        app.run(
-            host="0.0.0.0",
-            port=config.port
-        )
+        content = resp.content
+    return CachedResponse(resp.status_code, content, response_headers)
+
+
+def cached_proxy(path: str, target_url: str, headers: dict, access_token: str, share_token: str, ttl: float):
+    key = (access_token, path, request.query_string)
+    entry, state = response_cache.get(key)
+    if entry is None:
+        try:
+            entry = response_cache.load(key, lambda: fetch_cacheable(target_url, headers, share_token), ttl,
+                                        response_cache_stale)
+        except RequestException as e:
+            logger.exception("Upstream request failed: %s", target_url)
+            return str(e), 500
+    elif state == STALE:
+        # 先返回旧值，后台刷新
+        def loader():
+            fresh = fetch_cacheable(target_url, headers, share_token)
+            return fresh if fresh.status == 200 else None
+        response_cache.revalidate(key, loader, ttl, response_cache_stale)
+    return Response(
+        response=entry.body,
+        status=entry.status,
+        headers={**entry.headers, 'X-Mirror-Cache': state}
+    )
+
+
+def apply_config(new_config: Config) -> None:
+    """应用可在运行中修改的配置，启动与热加载共用"""
+    global config, response_cache_routes, response_cache_stale, conversation_cache_ttl
+    config = new_config
+    # 总是重新配置，config.yml 中清空代理时回到 PROXY 环境变量（未设置则直连）
+    egress_pool.configure(config.proxy or parse_proxies(os.getenv('PROXY', '')))
+    quota_engine.window = config.quota_window
+    for key in ('account_limit', 'share_limit', 'max_queue', 'max_share_queue', 'max_wait'):
+        if key in config.concurrency:
+            setattr(stream_scheduler, key, config.concurrency[key])
+    # 整体替换，请求线程遍历旧字典时不受影响
+    response_cache_routes = dict(config.response_cache.get('routes') or {})
+    response_cache_stale = config.response_cache.get('stale', response_cache_stale)
+    response_cache.max_bytes = config.response_cache.get('max_bytes', response_cache.max_bytes)
+    conversation_cache_ttl = config.conversation_cache.get('ttl', conversation_cache_ttl)
+    conversation_cache.max_bytes = config.conversation_cache.get('max_bytes', conversation_cache.max_bytes)
+    for key in ('max_in_flight', 'target_delay', 'conversation_wait', 'trust_request_start'):
+        if key in config.admission:
+            setattr(admission, key, config.admission[key])
+    for key in ('drain_timeout', 'flush_timeout'):
+        if key in config.shutdown:
+            setattr(lifecycle, key, config.shutdown[key])
+    if websocket_relay is not None and config.websocket.get('allowed_hosts'):
+        websocket_relay.allowed_hosts = tuple(config.websocket['allowed_hosts'])
+
+
+def build_ssl_context(cfg: Config) -> ssl.SSLContext:
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ssl_context.load_cert_chain(cfg.tls_cert, cfg.tls_key)
+    tune_ssl_context(ssl_context, cfg)
+    return ssl_context
+
+
+def tune_ssl_context(ssl_context: ssl.SSLContext, cfg: Config) -> None:
+    """密码套件（TLS1.2）与 TLS1.3 会话票据数量，票据用于复用会话、跳过完整握手"""
+    if cfg.tls_ciphers:
+        ssl_context.set_ciphers(cfg.tls_ciphers)
+    ssl_context.num_tickets = cfg.tls_session_tickets
+
+
+def load_server():
+    """导入所选服务器的实现，返回创建函数 (host, port) -> server"""
+    global websocket_relay
+    if config.server == 'hypercorn':
+        try:
+            from utils.server_util import HypercornServer
+        except ImportError:
+            raise SystemExit('server: hypercorn 需要安装 hypercorn: pip install hypercorn')
+        tls = None
+        if config.tls_enabled:
+            tls = {'cert': config.tls_cert, 'key': config.tls_key, 'ciphers': config.tls_ciphers,
+                   'session_tickets': config.tls_session_tickets}
+        if config.websocket.get('enabled', True):
+            from utils.websocket_util import DEFAULT_ALLOWED_HOSTS, WebSocketRelay
+            allowed_hosts = config.websocket.get('allowed_hosts') or DEFAULT_ALLOWED_HOSTS
+            websocket_relay = WebSocketRelay(resolve_websocket_auth, own_conversation, egress_pool,
+                                             is_draining=lambda: admission.draining, allowed_hosts=allowed_hosts)
+        # 每个进行中的请求（含会话流）占用一个线程，WebSocket 连接不占线程
+        return lambda host, port: HypercornServer(app, host, port, tls, threads=admission.max_in_flight + 64,
+                                                  graceful_timeout=lifecycle.drain_timeout,
+                                                  websocket=websocket_relay)
+    if config.server != 'werkzeug':
+        raise SystemExit(f'未知的 server: {config.server}')
+    from werkzeug.serving import make_server
+    ssl_context = build_ssl_context(config) if config.tls_enabled else None
+    return lambda host, port: make_server(host, port, app, threaded=True, ssl_context=ssl_context)
+
+
+def init_clients() -> None:
+    """创建上游与 Redis 客户端（不发起连接），启动时在后台预热，不阻塞开始监听"""
+    get_scraper()
+    _ = redis_utils.redis_client
+    if websocket_relay is not None:
+        import aiohttp  # noqa: F401
+
+
+def check(as_json: bool = False) -> int:
+    """
+    按启动顺序执行初始化但不监听端口、不连接 Redis，输出各阶段耗时
+    ready 为开始监听前的关键路径（import + config + server），clients 在后台预热
+
+    Returns:
+        int: 退出码，任一阶段失败时为 1
+    """
+    phases = {'import': time.perf_counter() - _import_start}
+    error = None
+    for name, step in (('config', lambda: apply_config(Config())), ('server', load_server),
+                       ('clients', init_clients)):
+        start = time.perf_counter()
+        try:
+            step()
+        except (Exception, SystemExit) as e:
+            error = f"{name}: {e}"
+            break
+        finally:
+            phases[name] = time.perf_counter() - start
+    phases['ready'] = sum(phases.get(name, 0) for name in ('import', 'config', 'server'))
+    phases['total'] = time.perf_counter() - _import_start
+    if as_json:
+        print(json.dumps({'phases_ms': {name: round(seconds * 1000, 2) for name, seconds in phases.items()},
+                          'error': error}))
+    else:
+        for name, seconds in phases.items():
+            print(f"{name:<8} {seconds * 1000:8.1f} ms")
+        if error:
+            print(f"FAILED {error}")
+    return 1 if error else 0
+
+
+def main():
+    apply_config(Config())
+    server = load_server()("0.0.0.0", config.port)
+    threading.Thread(target=init_clients, name='warmup', daemon=True).start()
+    token_manager.start()
+    housekeeper.start()
+
+    # SIGHUP: 重新读取配置，证书直接加载到正在使用的 SSLContext，新握手即生效，监听 socket 不变
+    @lifecycle.on_reload
+    def reload_config():
+        new_config = Config()
+        if (new_config.port, new_config.tls_enabled, new_config.server) != (config.port, config.tls_enabled,
+                                                                             config.server):
+            logger.warning("port/tls.enabled/server changes require a restart")
+        ssl_context = getattr(server, 'ssl_context', None)
+        if ssl_context is not None and new_config.tls_enabled:
+            ssl_context.load_cert_chain(new_config.tls_cert, new_config.tls_key)
+            tune_ssl_context(ssl_context, new_config)
+        apply_config(new_config)
+
+    # SIGTERM: 立即拒绝新请求（含长连接上的后续请求），停止监听后等待进行中的请求与会话流结束
+    @lifecycle.on_stop
+    def begin_drain():
+        admission.draining = True
+        # WebSocket 为长连接，以 1001 关闭后客户端会重连
+        if websocket_relay is not None:
+            websocket_relay.shutdown()
+
+    lifecycle.on_drain(admission.wait_idle)
+    lifecycle.on_flush(write_behind.flush)
+
+    lifecycle.install_signals()
+    logger.info("Serving on %s://0.0.0.0:%s (%s)", 'https' if config.tls_enabled else 'http', config.port,
+                config.server)
+    lifecycle.serve(server)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ChatGPT 镜像服务')
+    parser.add_argument('--check', action='store_true', help='只执行初始化并输出各阶段耗时，不启动服务')
+    parser.add_argument('--json', action='store_true', help='--check 结果以 JSON 输出')
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(check(args.json))
     main()
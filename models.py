@@ -93,6 +93,8 @@ IGNORE_HEADERS = {
     "authorization",
     "referer",
     "origin",
+    "x-mirror-trace",
+    "x-admin-token",
 }
 
 def filter_header(header: str) -> bool:
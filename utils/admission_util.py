@@ -0,0 +1,216 @@
+import functools
+import logging
+import math
+import threading
+import time
+from typing import Dict, Optional
+
+from flask import request, make_response
+from werkzeug.wsgi import ClosingIterator
+
+from utils import metrics_util
+from utils.common_util import route_class
+
+logger = logging.getLogger(__name__)
+
+# 负载达到该比例时拒绝对应类别，数值越小越先被丢弃
+SHED_THRESHOLDS = {
+    'static': 0.6,
+    'listing': 0.75,
+    'api': 0.9,
+    'conversation': 1.0,
+}
+# 前置代理（如 nginx）写入的请求到达时间，用于计算排队延迟
+REQUEST_START_HEADER = 'X-Request-Start'
+# hypercorn 模式下读完请求体、交给线程池前的时间（time.time()），由 server_util 写入 environ
+ACCEPTED_ENVIRON = 'mirror.accepted'
+
+ADMISSION_IN_FLIGHT = metrics_util.REGISTRY.register(metrics_util.Gauge(
+    'mirror_admission_in_flight', '各路由类别正在处理的请求数', ['route']))
+ADMISSION_REJECTED_TOTAL = metrics_util.REGISTRY.register(metrics_util.Counter(
+    'mirror_admission_rejected_total', '被过载保护拒绝的请求数', ['route']))
+ADMISSION_QUEUE_SECONDS = metrics_util.REGISTRY.register(metrics_util.Histogram(
+    'mirror_admission_queue_seconds', '请求进入视图前的排队延迟', ['route']))
+
+
+def admission_class(path: str, method: str) -> str:
+    """在 route_class 基础上区分会话列表翻页，便于优先丢弃"""
+    cls = route_class(path)
+    if cls == 'api' and method == 'GET' and path.lstrip('/').startswith('backend-api/conversations'):
+        return 'listing'
+    return cls if cls in SHED_THRESHOLDS else 'api'
+
+
+def _request_start_delay() -> Optional[float]:
+    """解析 X-Request-Start: t=<秒/毫秒/微秒>"""
+    value = request.headers.get(REQUEST_START_HEADER)
+    if not value:
+        return None
+    try:
+        start = float(value[2:] if value.startswith('t=') else value)
+    except ValueError:
+        return None
+    while start > 1e11:
+        start /= 1000
+    return max(time.time() - start, 0.0)
+
+
+def _accepted_delay() -> Optional[float]:
+    """hypercorn 模式下请求在线程池中排队的时间；werkzeug 每个连接一个线程，没有这段排队"""
+    accepted = request.environ.get(ACCEPTED_ENVIRON)
+    if accepted is None:
+        return None
+    return max(time.time() - accepted, 0.0)
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int = 256, target_delay: float = 0.1, conversation_wait: float = 2.0,
+                 delay_half_life: float = 1.0, trust_request_start: bool = False):
+        """
+        过载保护：按路由类别的优先级丢弃请求
+
+        Args:
+            max_in_flight: 同时处理的请求上限
+            target_delay: 排队延迟目标（秒），超过后开始丢弃低优先级请求
+            conversation_wait: 会话请求在满载时最多等待的秒数
+            delay_half_life: 排队延迟 EWMA 的衰减半衰期（秒）
+            trust_request_start: 是否信任前置代理写入的 X-Request-Start（直接对外暴露时应关闭）
+        """
+        self.max_in_flight = max_in_flight
+        self.target_delay = target_delay
+        self.conversation_wait = conversation_wait
+        self.delay_half_life = delay_half_life
+        self.trust_request_start = trust_request_start
+        self.in_flight: Dict[str, int] = {cls: 0 for cls in SHED_THRESHOLDS}
+        self.total = 0
+        # 所有进行中的 WSGI 请求（含未经 guard 的接口），停机排空时等待其归零
+        self.active = 0
+        # 停机排空时拒绝新请求并关闭长连接，已在处理的请求（含流式）继续完成
+        self.draining = False
+        self._delay = 0.0
+        self._delay_at = time.monotonic()
+        self._cond = threading.Condition()
+
+    @property
+    def max_in_flight(self) -> int:
+        return self._max_in_flight
+
+    @max_in_flight.setter
+    def max_in_flight(self, value: int) -> None:
+        # 0 或负数会使 load() 除零
+        self._max_in_flight = max(1, int(value))
+
+    def _decayed_delay(self, now: float) -> float:
+        return self._delay * math.pow(0.5, (now - self._delay_at) / self.delay_half_life)
+
+    def load(self) -> float:
+        """当前负载：并发占比与排队延迟占比取大，延迟部分不超过 0.99，只有并发满才会拒绝会话"""
+        delay = self._decayed_delay(time.monotonic())
+        return max(self.total / self.max_in_flight, min(delay / self.target_delay, 0.99))
+
+    def _observe_delay(self, delay: float) -> None:
+        now = time.monotonic()
+        current = self._decayed_delay(now)
+        self._delay = current + 0.2 * (delay - current)
+        self._delay_at = now
+
+    def admit(self, cls: str, queue_delay: Optional[float] = None) -> bool:
+        start = time.monotonic()
+        with self._cond:
+            if cls == 'conversation':
+                deadline = start + self.conversation_wait
+                while self.total >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            elif self.load() >= SHED_THRESHOLDS[cls]:
+                return False
+            waited = time.monotonic() - start
+            delay = waited if queue_delay is None else queue_delay + waited
+            self._observe_delay(delay)
+            self.in_flight[cls] += 1
+            self.total += 1
+        ADMISSION_QUEUE_SECONDS.labels(cls).observe(delay)
+        ADMISSION_IN_FLIGHT.labels(cls).inc()
+        return True
+
+    def release(self, cls: str) -> None:
+        with self._cond:
+            self.in_flight[cls] -= 1
+            self.total -= 1
+            self._cond.notify_all()
+        ADMISSION_IN_FLIGHT.labels(cls).dec()
+
+    def _leave(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def track(self, wsgi_app):
+        """包装 WSGI 应用：请求进入时计数，响应体（含流式）关闭后减一，供 wait_idle 等待"""
+
+        def app(environ, start_response):
+            with self._cond:
+                self.active += 1
+            try:
+                body = wsgi_app(environ, start_response)
+            except BaseException:
+                self._leave()
+                raise
+            return ClosingIterator(body, self._leave)
+
+        return app
+
+    def wait_idle(self, timeout: float) -> bool:
+        """
+        等待所有请求处理完成（按 track 的计数，覆盖 guard 之外的接口）
+
+        Returns:
+            bool: 超时前是否已全部完成
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def guard(self, view):
+        """包装视图函数：拒绝时快速返回 503，响应（含流式）关闭后释放名额"""
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            cls = admission_class(request.path, request.method)
+            if self.draining:
+                ADMISSION_REJECTED_TOTAL.labels(cls).inc()
+                headers = {'Retry-After': '1'}
+                # HTTP/2 不允许 Connection 头，由服务器发送 GOAWAY
+                if request.environ.get('SERVER_PROTOCOL', '').startswith('HTTP/1'):
+                    headers['Connection'] = 'close'
+                return {'detail': '服务正在重启，请稍后再试'}, 503, headers
+            queue_delay = _request_start_delay() if self.trust_request_start else None
+            if queue_delay is None:
+                queue_delay = _accepted_delay()
+            if not self.admit(cls, queue_delay):
+                ADMISSION_REJECTED_TOTAL.labels(cls).inc()
+                retry_after = 1 if cls == 'conversation' else 5
+                return {'detail': '服务繁忙，请稍后再试'}, 503, {'Retry-After': str(retry_after)}
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                self.release(cls)
+                raise
+            released = []
+
+            def release_once():
+                if not released:
+                    released.append(True)
+                    self.release(cls)
+
+            response.call_on_close(release_once)
+            return response
+
+        return wrapper
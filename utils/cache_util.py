@@ -0,0 +1,188 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from utils import metrics_util
+
+logger = logging.getLogger(__name__)
+
+FRESH = 'HIT'
+STALE = 'STALE'
+MISS = 'MISS'
+
+
+class CachedResponse:
+    __slots__ = ('status', 'body', 'headers', 'stored_at', 'ttl', 'stale_ttl')
+
+    def __init__(self, status: int, body: bytes, headers: Dict[str, str]):
+        self.status = status
+        self.body = body
+        self.headers = headers
+        self.stored_at = 0.0
+        self.ttl = 0.0
+        self.stale_ttl = 0.0
+
+    def size(self) -> int:
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers.items()) + 64
+
+
+class _Flight:
+    __slots__ = ('done', 'entry', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry: Optional[CachedResponse] = None
+        self.error: Optional[BaseException] = None
+
+
+class ResponseCache:
+    def __init__(self, name: str, max_bytes: int = 16 * 1024 * 1024, revalidate_workers: int = 4):
+        """
+        进程内短 TTL 响应缓存，按字节数做 LRU 淘汰，支持过期后先返回旧值再后台刷新
+
+        Args:
+            name: 缓存名，用于指标标签
+            max_bytes: 缓存总字节上限
+            revalidate_workers: 后台刷新线程数
+        """
+        self.name = name
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Hashable, CachedResponse]' = OrderedDict()
+        self._bytes = 0
+        self._refreshing = set()
+        # key -> 进行中的未命中回源，同一 key 的并发未命中共享结果
+        self._flights: Dict[Hashable, _Flight] = {}
+        # 分组 -> [失效代数, 回源中的请求数]，只在有回源进行时保留
+        self._fills: Dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=revalidate_workers, thread_name_prefix=f'{name}-revalidate')
+
+    def get(self, key: Hashable) -> Tuple[Optional[CachedResponse], str]:
+        """返回 (缓存项, HIT/STALE/MISS)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry.stored_at
+                if age < entry.ttl:
+                    self._entries.move_to_end(key)
+                    state = FRESH
+                elif age < entry.ttl + entry.stale_ttl:
+                    self._entries.move_to_end(key)
+                    state = STALE
+                else:
+                    self._remove(key)
+                    entry, state = None, MISS
+            else:
+                state = MISS
+        metrics_util.record_cache(self.name, state != MISS)
+        return entry, state
+
+    def put(self, key: Hashable, entry: CachedResponse, ttl: float, stale_ttl: float = 0) -> None:
+        entry.stored_at = time.time()
+        entry.ttl = ttl
+        entry.stale_ttl = stale_ttl
+        with self._lock:
+            self._store(key, entry)
+
+    def _store(self, key: Hashable, entry: CachedResponse) -> None:
+        size = entry.size()
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size()
+
+    def begin_fill(self, group: Hashable) -> int:
+        """开始回源，返回分组当前的失效代数，须与 end_fill 成对调用"""
+        with self._lock:
+            fill = self._fills.setdefault(group, [0, 0])
+            fill[1] += 1
+            return fill[0]
+
+    def end_fill(self, group: Hashable, generation: int, key: Hashable = None, entry: CachedResponse = None,
+                 ttl: float = 0) -> bool:
+        """结束回源，期间分组未失效时写入缓存，返回是否写入"""
+        if entry is not None:
+            entry.stored_at = time.time()
+            entry.ttl = ttl
+            entry.stale_ttl = 0
+        with self._lock:
+            fill = self._fills[group]
+            fill[1] -= 1
+            stored = entry is not None and fill[0] == generation
+            if stored:
+                self._store(key, entry)
+            if fill[1] == 0:
+                del self._fills[group]
+        return stored
+
+    def invalidate(self, predicate: Callable[[Hashable], bool], group: Hashable = None) -> int:
+        """删除满足条件的缓存项，返回删除数量；指定 group 时该分组进行中的回源结果不再写入"""
+        with self._lock:
+            if group in self._fills:
+                self._fills[group][0] += 1
+            keys = [k for k in self._entries if predicate(k)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def load(self, key: Hashable, loader: Callable[[], CachedResponse], ttl: float,
+             stale_ttl: float = 0) -> CachedResponse:
+        """未命中时回源，同一 key 的并发请求只回源一次，其余等待并共享结果（含异常）；只缓存 200"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.entry
+        try:
+            flight.entry = loader()
+            if flight.entry.status == 200:
+                self.put(key, flight.entry, ttl, stale_ttl)
+            return flight.entry
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def revalidate(self, key: Hashable, loader: Callable[[], Optional[CachedResponse]], ttl: float,
+                   stale_ttl: float = 0) -> None:
+        """后台刷新缓存，同一 key 同时只会刷新一次"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def task():
+            try:
+                entry = loader()
+                if entry is not None:
+                    self.put(key, entry, ttl, stale_ttl)
+            except Exception as e:
+                logger.warning("Cache %s revalidate failed: %s", self.name, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._entries), 'bytes': self._bytes}
@@ -1,15 +1,19 @@
 import json
 import logging
+import os
 import re
-from io import BytesIO
-from typing import Dict
+import time
+from typing import Callable, Dict, Optional
 from urllib.parse import urlparse
 
 from flask import request, Response
 
-import compress_utils
+from utils import metrics_util, share_store
+from utils.log_util import log_event
 from utils.redis_util import RedisUtils
 
+logger = logging.getLogger(__name__)
+
 
 # 替换js内容
 def modify_response_body(response, redis_util: RedisUtils) -> bytes:
@@ -31,7 +35,7 @@ def modify_response_body(response, redis_util: RedisUtils) -> bytes:
                 return content
         elif urlparse(response.url).path.startswith('/backend-api/conversations'):
             share_token = request.cookies.get("share_token")
-            username = redis_util.hash_get("share_token_info:" + share_token, 'user_name')
+            username = share_store.get_share_field(redis_util, share_token, 'user_name')
             cur_user_conversations = redis_util.set_members('user_conversations:' + username)
             conversation_ids = [] if cur_user_conversations is None else cur_user_conversations
             # conversation_ids转换成map
@@ -40,10 +44,13 @@ def modify_response_body(response, redis_util: RedisUtils) -> bytes:
             # 获取用户对话
             for conversation_id in conversation_ids:
                 conversation_map[conversation_id] = conversation_id
+            locked = 0
             for item in data['items']:
-                print(conversation_map.get(item['id']))
                 if conversation_map.get(item['id']) is None:
                     item['title'] = '🔒'
+                    locked += 1
+            log_event(logger, 'conversations_filtered', logging.DEBUG, sample=0.01,
+                      total=len(data['items']), locked=locked)
             return json.dumps(data).encode()
         else:
             # 对于静态文件的处理
@@ -61,10 +68,20 @@ def modify_response_body(response, redis_util: RedisUtils) -> bytes:
                 # 如果不是文本文件，直接返回原内容
                 return content
     except Exception as e:
-        logging.error(f"Error modifying response body: {e}")
+        logger.error("Error modifying response body: %s", e)
         return response.content
 
 
+# 上游地址覆盖，格式: chatgpt.com=http://127.0.0.1:9000,cdn.oaistatic.com=http://127.0.0.1:9001
+# 仅用于压测/本地调试，未配置时直接访问官方域名
+UPSTREAM_HOSTS = {
+    host.strip(): base.strip().rstrip('/')
+    for host, _, base in (
+        item.partition('=') for item in os.getenv('UPSTREAM_HOSTS', '').split(',') if '=' in item
+    )
+}
+
+
 def build_target_url(source_url: str) -> str:
     parsed = urlparse(source_url)
 
@@ -78,6 +95,8 @@ def build_target_url(source_url: str) -> str:
         host = 'chatgpt.com'
         path = parsed.path
 
+    if host in UPSTREAM_HOSTS:
+        return f"{UPSTREAM_HOSTS[host]}{path}"
     return f"https://{host}{path}"
 
 
@@ -97,29 +116,83 @@ def body_need_handle(url: str) -> bool:
             or parsed.path.startswith('/backend-api/conversations'))
 
 
+# 路由类别，用于指标统计
+def route_class(path: str) -> str:
+    path = path.lstrip('/')
+    if path == 'backend-api/conversation':
+        return 'conversation'
+    if path == '' or path.startswith(('c/', 'g/')):
+        return 'page'
+    if path.startswith('api/') or path == 'metrics':
+        return 'internal'
+    if path.startswith('assets/') or path.endswith(('.js', '.css', '.webp', '.png', '.svg', '.ico', '.woff2')):
+        return 'static'
+    return 'api'
+
+
 def set_if_not_empty(target_headers: Dict, source_headers: Dict, key: str) -> None:
     if key in source_headers:
         target_headers[key] = source_headers[key]
 
 
-# 流式输出
-def stream_response(user_name, response, redis_utils: RedisUtils):
-    def generate():
-        content_encoding = response.headers.get('Content-Encoding')
-        reader = compress_utils.wrap_reader(response.raw, content_encoding)
-        writer = compress_utils.wrap_writer(BytesIO(), content_encoding)
+# 上游响应每次读取的最大字节数，分块传输时收到一块即转发，不会等待凑满
+STREAM_READ_SIZE = 16 * 1024
+# 只在流开头查找会话 ID，超过该长度仍未找到则不再缓存行数据
+CONVERSATION_SCAN_LIMIT = 256 * 1024
+
 
+def find_conversation_id(line: bytes) -> Optional[str]:
+    """解析 SSE 数据行中的 conversation_detail_metadata 事件"""
+    if b'"conversation_detail_metadata"' not in line or not line.startswith(b'data:'):
+        return None
+    try:
+        event = json.loads(line[5:])
+    except ValueError:
+        return None
+    if isinstance(event, dict) and event.get('type') == 'conversation_detail_metadata':
+        return event.get('conversation_id')
+    return None
 
-        while True:
-            chunk = reader.read(1)
-            if not chunk:
-                break
-            writer.write(chunk)
-            yield chunk
+
+# 流式输出，边转发边识别会话 ID；on_finish 在上游读完后、结束块发出前调用
+def stream_response(response, on_conversation: Optional[Callable[[str], None]] = None,
+                    on_finish: Optional[Callable[[], None]] = None):
+    def generate():
+        start = time.perf_counter()
+        relayed = 0
+        pending = b'' if on_conversation is not None else None
+        metrics_util.STREAMS_IN_FLIGHT.inc()
+        try:
+            # iter_content 会按 Content-Encoding 解压，响应头中不再透传该字段
+            for chunk in response.iter_content(chunk_size=STREAM_READ_SIZE):
+                if not chunk:
+                    continue
+                relayed += len(chunk)
+                # 先登记会话归属再转发该块
+                if pending is not None:
+                    pending += chunk
+                    *lines, pending = pending.split(b'\n')
+                    for line in lines:
+                        conversation_id = find_conversation_id(line.rstrip(b'\r'))
+                        if conversation_id:
+                            on_conversation(conversation_id)
+                            pending = None
+                            break
+                    if pending is not None and relayed > CONVERSATION_SCAN_LIMIT:
+                        pending = None
+                yield chunk
+        finally:
+            response.close()
+            if on_finish is not None:
+                on_finish()
+            metrics_util.STREAMS_IN_FLIGHT.dec()
+            metrics_util.observe_stage('stream', time.perf_counter() - start)
+            metrics_util.STREAM_BYTES.observe(relayed)
+            metrics_util.RELAYED_BYTES_TOTAL.inc(relayed)
 
     response_headers = {
         k: v for k, v in response.headers.items()
-        if k in ['Content-Encoding', 'Content-Type']
+        if k == 'Content-Type'
     }
 
     return Response(
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Union
+from urllib.parse import urlparse
+
+from utils import metrics_util
+
+logger = logging.getLogger(__name__)
+
+
+class Egress:
+    """单个出口代理及其被动健康状态"""
+
+    def __init__(self, url: str):
+        self.url = url
+        parsed = urlparse(url)
+        # 指标与日志中只展示 host:port，避免泄露代理账号密码
+        self.label = f"{parsed.hostname}:{parsed.port}" if parsed.port else str(parsed.hostname)
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.in_flight = 0
+
+    def healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def score(self) -> float:
+        # 延迟越低、错误率越低、并发越少越优先
+        return (self.latency or 0.1) * (1 + 10 * self.error_rate) * (1 + self.in_flight)
+
+
+class Lease:
+    """已占用的出口并发，release 可重复调用"""
+
+    def __init__(self, pool: 'EgressPool', egress: Optional[Egress]):
+        self._pool = pool
+        self.egress = egress
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self.egress)
+
+
+class EgressPool:
+    def __init__(self, urls: Iterable[str] = (), alpha: float = 0.3, eject_after: int = 3,
+                 eject_seconds: float = 30.0, max_eject_seconds: float = 600.0):
+        """
+        多出口代理池
+
+        Args:
+            urls: 代理地址列表，为空时直连
+            alpha: 延迟/错误率 EWMA 平滑系数
+            eject_after: 连续失败多少次后摘除
+            eject_seconds: 首次摘除时长，之后指数退避
+            max_eject_seconds: 最长摘除时长
+        """
+        self.alpha = alpha
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self._lock = threading.Lock()
+        self.egresses: List[Egress] = []
+        self.configure(urls)
+
+    def configure(self, urls: Iterable[str]) -> None:
+        """更新代理列表，保留仍在列表中的出口的健康状态"""
+        urls = [u.strip() for u in urls if u and u.strip()]
+        with self._lock:
+            existing = {e.url: e for e in self.egresses}
+            self.egresses = [existing.get(url) or Egress(url) for url in dict.fromkeys(urls)]
+
+    def select(self, sticky_key: Optional[str] = None) -> Optional[Egress]:
+        """
+        选择出口
+
+        Args:
+            sticky_key: 粘性键（如 share_token），相同键在出口健康时总是落到同一出口
+
+        Returns:
+            Optional[Egress]: 未配置代理时返回 None
+        """
+        egresses = self.egresses
+        if not egresses:
+            return None
+        now = time.monotonic()
+        candidates = [e for e in egresses if e.healthy(now)]
+        if not candidates:
+            # 全部被摘除时选择最早恢复的，避免完全不可用
+            return min(egresses, key=lambda e: e.ejected_until)
+        if sticky_key:
+            return max(candidates, key=lambda e: _rendezvous(sticky_key, e.url))
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if first.score() <= second.score() else second
+
+    def report(self, egress: Optional[Egress], latency: float, ok: bool) -> None:
+        """上报一次请求结果，用于延迟/错误率统计与被动健康检查"""
+        if egress is None:
+            return
+        with self._lock:
+            egress.latency = latency if egress.latency == 0 else \
+                egress.latency + self.alpha * (latency - egress.latency)
+            egress.error_rate += self.alpha * ((0.0 if ok else 1.0) - egress.error_rate)
+            if ok:
+                egress.failures = 0
+                egress.ejections = 0
+                return
+            egress.failures += 1
+            if egress.failures >= self.eject_after:
+                egress.ejections += 1
+                seconds = min(self.eject_seconds * 2 ** (egress.ejections - 1), self.max_eject_seconds)
+                egress.ejected_until = time.monotonic() + seconds
+                egress.failures = 0
+                logger.warning("Egress %s ejected for %.0fs", egress.label, seconds)
+
+    def acquire(self, egress: Optional[Egress]) -> None:
+        if egress is not None:
+            with self._lock:
+                egress.in_flight += 1
+
+    def lease(self, egress: Optional[Egress]) -> Lease:
+        """占用出口并发直到 release，用于响应体读完才结束的请求"""
+        self.acquire(egress)
+        return Lease(self, egress)
+
+    def release(self, egress: Optional[Egress]) -> None:
+        if egress is not None:
+            with self._lock:
+                egress.in_flight -= 1
+
+    @staticmethod
+    def proxies(egress: Optional[Egress]) -> Dict[str, str]:
+        """转换为 requests 的 proxies 参数"""
+        url = egress.url if egress is not None else ''
+        return {'http': url, 'https': url}
+
+
+def is_egress_failure(status_code: int) -> bool:
+    """
+    只有 502~504 网关错误计入出口失败（连接失败由调用方直接上报）
+    429 多为上游按账号限流，与出口无关，计入会把健康的出口摘除
+    """
+    return 502 <= status_code <= 504
+
+
+def _rendezvous(key: str, url: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f'{key}|{url}'.encode(), digest_size=8).digest(), 'big')
+
+
+def parse_proxies(value: Union[str, List[str], None]) -> List[str]:
+    """支持逗号分隔字符串或列表"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return [str(v).strip() for v in value if str(v).strip()]
+
+
+# 全局出口池，默认读取 PROXY 环境变量（逗号分隔多个），main() 中会以 config.yml 覆盖
+egress_pool = EgressPool(parse_proxies(os.getenv('PROXY', '')))
+
+EGRESS_HEALTHY = metrics_util.REGISTRY.register(metrics_util.Gauge(
+    'mirror_egress_healthy', '出口代理是否健康', ['egress']))
+EGRESS_LATENCY = metrics_util.REGISTRY.register(metrics_util.Gauge(
+    'mirror_egress_latency_seconds', '出口代理 EWMA 延迟', ['egress']))
+EGRESS_IN_FLIGHT = metrics_util.REGISTRY.register(metrics_util.Gauge(
+    'mirror_egress_in_flight', '经由出口代理进行中的请求与中继连接数', ['egress']))
+EGRESS_HEALTHY.set_function(lambda: {
+    (e.label,): 1.0 if e.healthy(time.monotonic()) else 0.0 for e in egress_pool.egresses
+})
+EGRESS_LATENCY.set_function(lambda: {(e.label,): e.latency for e in egress_pool.egresses})
+EGRESS_IN_FLIGHT.set_function(lambda: {(e.label,): float(e.in_flight) for e in egress_pool.egresses})
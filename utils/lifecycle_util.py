@@ -0,0 +1,104 @@
+import logging
+import signal
+import threading
+import time
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    def __init__(self, drain_timeout: float = 30, flush_timeout: float = 5):
+        """
+        进程生命周期管理：SIGTERM/SIGINT 优雅停机，SIGHUP 热加载配置
+
+        Args:
+            drain_timeout: 停机时等待进行中请求（含会话流）结束的最长秒数
+            flush_timeout: 停机时等待后台写入完成的最长秒数
+        """
+        self.drain_timeout = drain_timeout
+        self.flush_timeout = flush_timeout
+        self._server = None
+        self._reloaders: List[Callable[[], None]] = []
+        self._stoppers: List[Callable[[], None]] = []
+        self._drainers: List[Callable[[float], bool]] = []
+        self._flushers: List[Callable[[float], bool]] = []
+        self._stopping = threading.Event()
+        self._reload_lock = threading.Lock()
+
+    def on_reload(self, fn: Callable[[], None]) -> Callable[[], None]:
+        self._reloaders.append(fn)
+        return fn
+
+    def on_stop(self, fn: Callable[[], None]) -> Callable[[], None]:
+        """注册收到停机信号时立即执行的步骤（先于停止监听）"""
+        self._stoppers.append(fn)
+        return fn
+
+    def on_drain(self, fn: Callable[[float], bool]) -> Callable[[float], bool]:
+        """注册停机步骤：参数为剩余秒数，返回是否在期限内完成"""
+        self._drainers.append(fn)
+        return fn
+
+    def on_flush(self, fn: Callable[[float], bool]) -> Callable[[float], bool]:
+        self._flushers.append(fn)
+        return fn
+
+    def install_signals(self) -> None:
+        """注册信号处理，须在主线程调用"""
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._handle_reload)
+
+    def _handle_stop(self, signum, frame) -> None:
+        if self._stopping.is_set():
+            # 第二次信号直接退出
+            raise SystemExit(1)
+        logger.info("Received signal %s, draining", signum)
+        self._stopping.set()
+        # serve_forever 运行在主线程，shutdown 必须在其他线程调用
+        threading.Thread(target=self._stop_serving, name='lifecycle-stop', daemon=True).start()
+
+    def _handle_reload(self, signum, frame) -> None:
+        threading.Thread(target=self.reload, name='lifecycle-reload', daemon=True).start()
+
+    def _stop_serving(self) -> None:
+        for fn in self._stoppers:
+            fn()
+        if self._server is not None:
+            self._server.shutdown()
+
+    def reload(self) -> None:
+        with self._reload_lock:
+            for fn in self._reloaders:
+                try:
+                    fn()
+                except Exception as e:
+                    logger.error("Reload failed in %s: %s", getattr(fn, '__name__', fn), e)
+            logger.info("Configuration reloaded")
+
+    def serve(self, server) -> None:
+        """
+        运行服务直到收到停机信号，停止监听后排空请求并刷新后台写入
+
+        Args:
+            server: 提供 serve_forever/shutdown/server_close 的服务器
+        """
+        self._server = server
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        deadline = time.monotonic() + self.drain_timeout
+        for fn in self._drainers:
+            if not fn(max(deadline - time.monotonic(), 0)):
+                logger.warning("Drain deadline exceeded in %s", getattr(fn, '__name__', fn))
+        deadline = time.monotonic() + self.flush_timeout
+        for fn in self._flushers:
+            if not fn(max(deadline - time.monotonic(), 0)):
+                logger.warning("Flush deadline exceeded in %s", getattr(fn, '__name__', fn))
+        logger.info("Shutdown complete")
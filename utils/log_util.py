@@ -0,0 +1,136 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+from typing import Any, Optional
+
+from utils import metrics_util
+
+# 需要脱敏的字段名（小写）
+SENSITIVE_KEYS = {
+    'authorization', 'cookie', 'set-cookie', 'access_token', 'refresh_token',
+    'share_token', 'm_token', 'token', 'password',
+}
+_MASK = '***'
+_SENSITIVE_PATTERNS = [
+    (re.compile(r'(Bearer\s+)[^\s"\',;]+', re.IGNORECASE), r'\1' + _MASK),
+    (re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]+'), _MASK),
+    (re.compile(r'((?:share_token|access_token|refresh_token|m_token)["\']?\s*[=:]\s*["\']?)[^\s"\',;&]+',
+                re.IGNORECASE), r'\1' + _MASK),
+]
+
+_listener: Optional[logging.handlers.QueueListener] = None
+dropped_records = 0
+
+
+def redact(value: Any) -> Any:
+    """递归脱敏字典/列表/字符串中的凭据"""
+    if isinstance(value, dict):
+        return {
+            k: _MASK if str(k).lower() in SENSITIVE_KEYS else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        for pattern, replacement in _SENSITIVE_PATTERNS:
+            value = pattern.sub(replacement, value)
+        return value
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """单行 JSON 输出，附带 extra={'fields': {...}} 中的结构化字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact(record.getMessage()),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry['exc'] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 格式化与脱敏留给后台线程完成，请求线程只负责入队
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # 队列满时直接丢弃，不阻塞请求线程
+            dropped_records += 1
+            metrics_util.LOG_DROPPED_TOTAL.inc()
+
+
+def setup_logging(level: Optional[str] = None, queue_size: int = 10000) -> None:
+    """
+    初始化队列异步日志，重复调用无副作用
+
+    Args:
+        level: 日志级别，默认读取 LOG_LEVEL 环境变量
+        queue_size: 日志队列长度上限
+    """
+    global _listener
+    if _listener is not None:
+        return
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_NonBlockingQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """刷新队列中剩余日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO,
+              sample: float = 1.0, **fields: Any) -> None:
+    """
+    记录结构化事件
+
+    Args:
+        logger: 日志对象
+        event: 事件名
+        level: 日志级别
+        sample: 采样率，高频事件可设为小于 1 的值
+        fields: 结构化字段
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample < 1.0 and random.random() >= sample:
+        return
+    if sample < 1.0:
+        fields['sample'] = sample
+    fields['event'] = event
+    logger.log(level, event, extra={'fields': fields})
+
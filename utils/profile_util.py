@@ -0,0 +1,75 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+# 单次采样最长秒数
+MAX_PROFILE_SECONDS = 60
+# 请求追踪头，取值需与 ADMIN_TOKEN 一致
+TRACE_HEADER = 'X-Mirror-Trace'
+ADMIN_HEADER = 'X-Admin-Token'
+
+_profile_lock = threading.Lock()
+
+
+def admin_token() -> Optional[str]:
+    """未配置 ADMIN_TOKEN 时管理接口与追踪均关闭"""
+    return os.getenv('ADMIN_TOKEN') or None
+
+
+def is_admin(token: Optional[str]) -> bool:
+    expected = admin_token()
+    if expected is None or token is None:
+        return False
+    # 常数时间比较，避免通过响应耗时逐字节猜测
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> Optional[str]:
+    """
+    对所有线程做定时栈采样
+
+    Args:
+        seconds: 采样时长
+        interval: 采样间隔（秒）
+
+    Returns:
+        Optional[str]: folded stacks 格式（flamegraph.pl / speedscope 可直接读取），已有采样进行中时返回 None
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        me = threading.get_ident()
+        names = {}
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+        return '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common()) + '\n'
+    finally:
+        _profile_lock.release()
+
+
+def server_timing(stages: List[Tuple[str, float]]) -> str:
+    """阶段耗时转为 Server-Timing 响应头"""
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in stages)
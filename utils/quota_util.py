@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from utils import metrics_util
+from utils.redis_util import RedisUtils
+
+logger = logging.getLogger(__name__)
+
+# 模型前缀 -> Share 中的限额字段，按顺序匹配（长前缀在前）
+MODEL_LIMIT_FIELDS = (
+    ('gpt-4o-mini', 'gpt_4o_mini_limit'),
+    ('gpt-4o', 'gpt_4o_limit'),
+    ('o1-mini', 'gpt_o1_mini_limit'),
+    ('o1-preview', 'gpto1_preview_limit'),
+    ('o1', 'gpto1_preview_limit'),
+    ('gpt-4', 'gpt_4_limit'),
+)
+
+# 原子预占额度：返回实际分配的数量，不会超过 limit
+RESERVE_SCRIPT = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+local grant = math.min(tonumber(ARGV[2]), tonumber(ARGV[1]) - used)
+if grant <= 0 then
+    return 0
+end
+local total = redis.call('INCRBY', KEYS[1], grant)
+if total == grant then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return grant
+"""
+
+QUOTA_DECISIONS_TOTAL = metrics_util.REGISTRY.register(metrics_util.Counter(
+    'mirror_quota_decisions_total', '额度校验结果', ['result']))
+
+
+def limit_field(model: Optional[str]) -> Optional[str]:
+    """根据模型名找到对应的限额字段，未匹配的模型不限额"""
+    if not model:
+        return None
+    for prefix, field_name in MODEL_LIMIT_FIELDS:
+        if model.startswith(prefix):
+            return field_name
+    return None
+
+
+def _to_int(value: Any, default: int = -1) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class QuotaEngine:
+    def __init__(self, redis_utils: RedisUtils, window: int = 10800, max_batch: int = 5):
+        """
+        分享额度校验，Redis 原子计数 + 进程内令牌预分配
+
+        Args:
+            redis_utils: Redis 工具
+            window: 额度统计窗口（秒）
+            max_batch: 单次从 Redis 预占的最大额度，限额越小预占越少，避免多进程间互相占用
+        """
+        self.redis_utils = redis_utils
+        self.window = window
+        self.max_batch = max_batch
+        self._buckets: Dict[Tuple[str, str, int], int] = {}
+        self._lock = threading.Lock()
+        self._script = None
+
+    def _reserve(self, key: str, limit: int, want: int) -> int:
+        if self._script is None:
+            self._script = self.redis_utils.redis_client.register_script(RESERVE_SCRIPT)
+        return int(self._script(keys=[key], args=[limit, want, self.window]))
+
+    @staticmethod
+    def _limit(share_info: Dict[str, Any], model: Optional[str]) -> Tuple[Optional[str], int]:
+        """返回 (限额字段, 限额)，不限额时字段为 None 或限额 < 0"""
+        field_name = limit_field(model)
+        if field_name is None or str(share_info.get('gpt_limit_enable')).lower() not in ('true', '1'):
+            return None, -1
+        return field_name, _to_int(share_info.get(field_name))
+
+    def refund(self, share_token: str, share_info: Dict[str, Any], model: Optional[str]) -> None:
+        """退还 check 扣减的一次额度（请求未到达上游时），放回本进程的预分配中"""
+        field_name, limit = self._limit(share_info, model)
+        if field_name is None or limit <= 0:
+            return
+        bucket_key = (share_token, field_name, int(time.time()) // self.window)
+        with self._lock:
+            self._buckets[bucket_key] = self._buckets.get(bucket_key, 0) + 1
+        QUOTA_DECISIONS_TOTAL.labels('refunded').inc()
+
+    def check(self, share_token: str, share_info: Dict[str, Any], model: Optional[str]) -> Optional[Tuple[int, str]]:
+        """
+        校验并扣减一次额度
+
+        Returns:
+            Optional[Tuple[int, str]]: 超额时返回 (状态码, 提示)，允许时返回 None
+        """
+        expire_at = _to_int(share_info.get('expire_at'))
+        if expire_at > 0:
+            # 兼容毫秒时间戳
+            if expire_at > 10 ** 12:
+                expire_at //= 1000
+            if expire_at <= time.time():
+                QUOTA_DECISIONS_TOTAL.labels('expired').inc()
+                return 403, '分享已过期'
+
+        field_name, limit = self._limit(share_info, model)
+        if field_name is None or limit < 0:
+            QUOTA_DECISIONS_TOTAL.labels('unlimited').inc()
+            return None
+        if limit == 0:
+            QUOTA_DECISIONS_TOTAL.labels('rejected').inc()
+            return 429, f'当前分享无权使用 {model}'
+
+        window_index = int(time.time()) // self.window
+        bucket_key = (share_token, field_name, window_index)
+        with self._lock:
+            if self._buckets.get(bucket_key, 0) > 0:
+                self._buckets[bucket_key] -= 1
+                QUOTA_DECISIONS_TOTAL.labels('local').inc()
+                return None
+
+        want = max(1, min(self.max_batch, limit // 20))
+        redis_key = f'quota:{share_token}:{field_name}:{window_index}'
+        try:
+            granted = self._reserve(redis_key, limit, want)
+        except Exception as e:
+            # Redis 异常时放行，避免额度系统故障影响正常使用
+            logger.error("Error reserving quota: %s", e)
+            QUOTA_DECISIONS_TOTAL.labels('error').inc()
+            return None
+        if granted <= 0:
+            QUOTA_DECISIONS_TOTAL.labels('rejected').inc()
+            return 429, f'{model} 已达到使用上限，请稍后再试'
+
+        with self._lock:
+            # 丢弃过期窗口的预分配
+            for key in [k for k in self._buckets if k[2] != window_index]:
+                del self._buckets[key]
+            self._buckets[bucket_key] = self._buckets.get(bucket_key, 0) + granted - 1
+        QUOTA_DECISIONS_TOTAL.labels('redis').inc()
+        return None
@@ -1,13 +1,20 @@
-import redis
-from typing import Any, Optional, List, Dict, Union
+import logging
+import queue
+import threading
+import time
+
+from typing import Any, Optional, List, Dict, Union, Iterator, Tuple
 import json
 from datetime import datetime, timedelta
 
+logger = logging.getLogger(__name__)
+
+
 class RedisUtils:
     def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0,
                  password: Optional[str] = None, decode_responses: bool = True):
         """
-        初始化 Redis 连接
+        初始化 Redis 连接参数，客户端在首次使用时创建
 
         Args:
             host: Redis 服务器地址
@@ -16,13 +23,23 @@ class RedisUtils:
             password: Redis 密码
             decode_responses: 是否自动解码响应
         """
-        self.redis_client = redis.Redis(
-            host=host,
-            port=port,
-            db=db,
-            password=password,
-            decode_responses=decode_responses
-        )
+        self._options = dict(host=host, port=port, db=db, password=password, decode_responses=decode_responses)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def redis_client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # redis 包导入较慢（含 redis.asyncio），延迟到首次使用
+                    import redis
+                    self._client = redis.Redis(**self._options)
+        return self._client
+
+    @redis_client.setter
+    def redis_client(self, client) -> None:
+        self._client = client
 
     def set_value(self, key: str, value: Any, expire_seconds: Optional[int] = None) -> bool:
         """
@@ -37,8 +54,8 @@ class RedisUtils:
             bool: 操作是否成功
         """
         try:
-            # 如果是复杂数据类型，转换为 JSON
-            if not isinstance(value, (str, int, float, bool)):
+            # 如果是复杂数据类型(含 bool，redis 客户端不接受)，转换为 JSON
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
                 value = json.dumps(value)
 
             self.redis_client.set(key, value)
@@ -46,7 +63,7 @@ class RedisUtils:
                 self.redis_client.expire(key, expire_seconds)
             return True
         except Exception as e:
-            print(f"Error setting value: {str(e)}")
+            logger.error("Error setting value: %s", e)
             return False
 
     def get_value(self, key: str, default: Any = None) -> Any:
@@ -71,7 +88,7 @@ class RedisUtils:
             except json.JSONDecodeError:
                 return value
         except Exception as e:
-            print(f"Error getting value: {str(e)}")
+            logger.error("Error getting value: %s", e)
             return default
 
     def delete_keys(self, *keys: str) -> int:
@@ -87,7 +104,7 @@ class RedisUtils:
         try:
             return self.redis_client.delete(*keys)
         except Exception as e:
-            print(f"Error deleting keys: {str(e)}")
+            logger.error("Error deleting keys: %s", e)
             return 0
 
     def increment(self, key: str, amount: int = 1) -> Optional[int]:
@@ -104,7 +121,7 @@ class RedisUtils:
         try:
             return self.redis_client.incrby(key, amount)
         except Exception as e:
-            print(f"Error incrementing value: {str(e)}")
+            logger.error("Error incrementing value: %s", e)
             return None
 
     def hash_set(self, name: str, mapping: Dict[str, Any]) -> bool:
@@ -121,13 +138,13 @@ class RedisUtils:
         try:
             # 将复杂数据类型转换为 JSON
             processed_mapping = {
-                k: json.dumps(v) if not isinstance(v, (str, int, float, bool)) else v
+                k: json.dumps(v) if isinstance(v, bool) or not isinstance(v, (str, int, float)) else v
                 for k, v in mapping.items()
             }
             self.redis_client.hmset(name, processed_mapping)
             return True
         except Exception as e:
-            print(f"Error setting hash: {str(e)}")
+            logger.error("Error setting hash: %s", e)
             return False
 
     def hash_get(self, name: str, key: Optional[str] = None) -> Union[Dict, Any, None]:
@@ -154,7 +171,7 @@ class RedisUtils:
                 return {k: self._try_json_decode(v) for k, v in result.items()}
             return self._try_json_decode(result)
         except Exception as e:
-            print(f"Error getting hash: {str(e)}")
+            logger.error("Error getting hash: %s", e)
             return None
 
     def list_push(self, name: str, *values: Any, left: bool = True) -> Optional[int]:
@@ -172,7 +189,7 @@ class RedisUtils:
         try:
             # 序列化复杂数据类型
             processed_values = [
-                json.dumps(v) if not isinstance(v, (str, int, float, bool)) else v
+                json.dumps(v) if isinstance(v, bool) or not isinstance(v, (str, int, float)) else v
                 for v in values
             ]
 
@@ -180,7 +197,7 @@ class RedisUtils:
                 return self.redis_client.lpush(name, *processed_values)
             return self.redis_client.rpush(name, *processed_values)
         except Exception as e:
-            print(f"Error pushing to list: {str(e)}")
+            logger.error("Error pushing to list: %s", e)
             return None
 
     def list_get_all(self, name: str) -> List[Any]:
@@ -197,7 +214,7 @@ class RedisUtils:
             values = self.redis_client.lrange(name, 0, -1)
             return [self._try_json_decode(v) for v in values]
         except Exception as e:
-            print(f"Error getting list: {str(e)}")
+            logger.error("Error getting list: %s", e)
             return []
 
     def set_add(self, name: str, *values: Any) -> Optional[int]:
@@ -213,12 +230,12 @@ class RedisUtils:
         """
         try:
             processed_values = [
-                json.dumps(v) if not isinstance(v, (str, int, float, bool)) else v
+                json.dumps(v) if isinstance(v, bool) or not isinstance(v, (str, int, float)) else v
                 for v in values
             ]
             return self.redis_client.sadd(name, *processed_values)
         except Exception as e:
-            print(f"Error adding to set: {str(e)}")
+            logger.error("Error adding to set: %s", e)
             return None
 
     def set_members(self, name: str) -> List[Any]:
@@ -235,7 +252,7 @@ class RedisUtils:
             values = self.redis_client.smembers(name)
             return [self._try_json_decode(v) for v in values]
         except Exception as e:
-            print(f"Error getting set members: {str(e)}")
+            logger.error("Error getting set members: %s", e)
             return []
 
     def _try_json_decode(self, value: Any) -> Any:
@@ -255,12 +272,127 @@ class RedisUtils:
         except (json.JSONDecodeError, TypeError):
             return value
 
+    def scan_keys(self, pattern: str, count: int = 500) -> Iterator[str]:
+        """
+        增量遍历匹配的键，不阻塞 Redis
+
+        Args:
+            pattern: 匹配模式
+            count: 每次 SCAN 的建议数量
+
+        Returns:
+            Iterator[str]: 匹配的键
+        """
+        try:
+            yield from self.redis_client.scan_iter(match=pattern, count=count)
+        except Exception as e:
+            logger.error("Error scanning keys: %s", e)
+
+    @staticmethod
+    def is_wrong_type(error: Exception) -> bool:
+        """命令作用于类型不符的键（如对哈希执行 GET）"""
+        return str(error).startswith('WRONGTYPE')
+
+    def pool_stats(self) -> Dict[str, int]:
+        """
+        获取连接池使用情况
+
+        Returns:
+            Dict[str, int]: 使用中/空闲/已创建的连接数
+        """
+        if self._client is None:
+            return {'in_use': 0, 'available': 0, 'created': 0}
+        pool = self._client.connection_pool
+        return {
+            'in_use': len(getattr(pool, '_in_use_connections', ())),
+            'available': len(getattr(pool, '_available_connections', ())),
+            'created': getattr(pool, '_created_connections', 0),
+        }
+
     def close(self):
         """关闭 Redis 连接"""
-        self.redis_client.close()
+        if self._client is not None:
+            self._client.close()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
\ No newline at end of file
+        self.close()
+
+
+class WriteBehind:
+    def __init__(self, redis_utils: RedisUtils, max_batch: int = 500, max_queue: int = 100000):
+        """
+        异步批量写入，请求线程只入队，后台线程合并为 pipeline 提交
+
+        Args:
+            redis_utils: Redis 工具
+            max_batch: 每个 pipeline 的最大命令数
+            max_queue: 队列上限，写满时退化为同步写入
+        """
+        self.redis_utils = redis_utils
+        self.max_batch = max_batch
+        self._queue: 'queue.Queue[Tuple[str, tuple]]' = queue.Queue(max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def set_add(self, name: str, *values: Any) -> None:
+        self._submit('sadd', (name, *values))
+
+    def _submit(self, command: str, args: tuple) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((command, args))
+        except queue.Full:
+            logger.warning("Write-behind queue full, writing synchronously")
+            self._execute([(command, args)])
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='redis-write-behind', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._execute(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _execute(self, batch: List[Tuple[str, tuple]]) -> None:
+        try:
+            pipe = self.redis_utils.redis_client.pipeline(transaction=False)
+            for command, args in batch:
+                getattr(pipe, command)(*args)
+            pipe.execute()
+        except Exception as e:
+            logger.error("Write-behind flush of %d commands failed: %s", len(batch), e)
+
+    def pending(self) -> int:
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        等待已入队的写入完成
+
+        Returns:
+            bool: 超时前是否全部写入
+        """
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
@@ -0,0 +1,322 @@
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from utils import metrics_util
+from utils.redis_util import RedisUtils
+
+logger = logging.getLogger(__name__)
+
+# 原子占用账号与分享的并发槽位，返回 1 成功，0 账号已满，-1 分享已满；未传 KEYS[2]（无分享）时只限制账号
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+for _, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+end
+if #KEYS > 1 and tonumber(ARGV[5]) > 0 and redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[5]) then
+    return -1
+end
+if tonumber(ARGV[4]) > 0 and redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+    return 0
+end
+for _, key in ipairs(KEYS) do
+    redis.call('ZADD', key, ARGV[2], ARGV[3])
+    redis.call('EXPIRE', key, ARGV[6])
+end
+return 1
+"""
+
+SCHEDULER_DECISIONS_TOTAL = metrics_util.REGISTRY.register(metrics_util.Counter(
+    'mirror_scheduler_decisions_total', '会话并发调度结果', ['result']))
+SCHEDULER_QUEUED = metrics_util.REGISTRY.register(metrics_util.Gauge(
+    'mirror_scheduler_queued', '等待会话并发槽位的请求数'))
+SCHEDULER_WAIT_SECONDS = metrics_util.REGISTRY.register(metrics_util.Histogram(
+    'mirror_scheduler_wait_seconds', '等待会话并发槽位的耗时'))
+
+
+class SchedulerRejected(Exception):
+    def __init__(self, status: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Slot:
+    """已占用的并发槽位，release 可重复调用"""
+
+    def __init__(self, scheduler: Optional['StreamScheduler'], account: str, share: str, member: str,
+                 shared: bool = True):
+        self._scheduler = scheduler
+        self.account = account
+        self.share = share
+        self.member = member
+        # 是否计入分享的并发，直接使用 access_token 时只计入账号
+        self.shared = shared
+        self._released = False
+
+    def keys(self) -> List[str]:
+        keys = [f'stream_slots:account:{self.account}']
+        if self.shared:
+            keys.append(f'stream_slots:share:{self.share}')
+        return keys
+
+    def release(self) -> None:
+        if self._released or self._scheduler is None:
+            return
+        self._released = True
+        self._scheduler._release(self)
+
+
+class _Waiter:
+    __slots__ = ('share', 'event')
+
+    def __init__(self, share: str):
+        self.share = share
+        self.event = threading.Event()
+
+
+class _AccountQueue:
+    """
+    按分享轮转的等待队列，避免单个分享占满账号的全部槽位
+    分享自身并发已满时标记为 blocked，不占用队首，由下一个分享先尝试；其队首仍轮询，等待本分享的槽位释放
+    """
+
+    def __init__(self):
+        self.order: Deque[str] = deque()
+        self.waiters: Dict[str, Deque[_Waiter]] = {}
+        self.blocked: Set[str] = set()
+        self.size = 0
+
+    def push(self, waiter: _Waiter) -> None:
+        if waiter.share not in self.waiters:
+            self.waiters[waiter.share] = deque()
+            self.order.append(waiter.share)
+        self.waiters[waiter.share].append(waiter)
+        self.size += 1
+
+    def queued(self, share: str) -> int:
+        return len(self.waiters.get(share, ()))
+
+    def head(self) -> Optional[_Waiter]:
+        for share in self.order:
+            if share not in self.blocked:
+                return self.waiters[share][0]
+        return None
+
+    def share_head(self, share: str) -> Optional[_Waiter]:
+        share_waiters = self.waiters.get(share)
+        return share_waiters[0] if share_waiters else None
+
+    def eligible(self, waiter: _Waiter) -> bool:
+        if self.share_head(waiter.share) is not waiter:
+            return False
+        return waiter.share in self.blocked or self.head() is waiter
+
+    def remove(self, waiter: _Waiter, granted: bool) -> None:
+        share_waiters = self.waiters.get(waiter.share)
+        if share_waiters is None or waiter not in share_waiters:
+            return
+        share_waiters.remove(waiter)
+        self.size -= 1
+        if granted:
+            self.blocked.discard(waiter.share)
+        if not share_waiters:
+            del self.waiters[waiter.share]
+            self.order.remove(waiter.share)
+            self.blocked.discard(waiter.share)
+        elif granted:
+            # 获得槽位后轮到下一个分享
+            self.order.remove(waiter.share)
+            self.order.append(waiter.share)
+
+
+class StreamScheduler:
+    def __init__(self, redis_utils: RedisUtils, account_limit: int = 5, share_limit: int = 2,
+                 max_queue: int = 32, max_share_queue: int = 8, max_wait: float = 20.0, lease: int = 600,
+                 poll_interval: float = 0.05):
+        """
+        会话流并发调度，槽位计数保存在 Redis 中以便多进程共享
+
+        Args:
+            redis_utils: Redis 工具
+            account_limit: 每个 access_token 的并发会话上限，<=0 不限制
+            share_limit: 每个 share_token 的并发会话上限，<=0 不限制
+            max_queue: 每个账号在本进程内的最大排队数
+            max_share_queue: 其中单个分享的最大排队数，避免一个分享占满账号的队列
+            max_wait: 最长排队秒数
+            lease: 槽位租约秒数，进行中的会话流由后台线程续租，进程异常退出时到期自动释放
+            poll_interval: 排队时轮询 Redis 的间隔
+        """
+        self.redis_utils = redis_utils
+        self.account_limit = account_limit
+        self.share_limit = share_limit
+        self.max_queue = max_queue
+        self.max_share_queue = max_share_queue
+        self.max_wait = max_wait
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._queues: Dict[str, _AccountQueue] = {}
+        self._active: Set[Slot] = set()
+        self._lock = threading.Lock()
+        self._script = None
+        self._renewer: Optional[threading.Thread] = None
+
+    def _try_acquire(self, account: str, share: str, shared: bool) -> Tuple[int, Optional[Slot]]:
+        if self._script is None:
+            self._script = self.redis_utils.redis_client.register_script(ACQUIRE_SCRIPT)
+        slot = Slot(self, account, share, uuid.uuid4().hex, shared)
+        now = time.time()
+        result = int(self._script(
+            keys=slot.keys(),
+            args=[now, now + self.lease, slot.member, self.account_limit, self.share_limit, self.lease]
+        ))
+        if result != 1:
+            return result, None
+        with self._lock:
+            self._active.add(slot)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_loop, name='stream-lease', daemon=True)
+                self._renewer.start()
+        return result, slot
+
+    def _renew_loop(self) -> None:
+        while True:
+            time.sleep(max(self.lease / 3, 1))
+            try:
+                self.renew()
+            except Exception as e:
+                logger.error("Error renewing stream slots: %s", e)
+
+    def renew(self) -> None:
+        """为进行中的会话流续租，超过租约时长的长会话不会被当作已结束"""
+        with self._lock:
+            slots = list(self._active)
+        if not slots:
+            return
+        expire_at = time.time() + self.lease
+        pipe = self.redis_utils.redis_client.pipeline(transaction=False)
+        for slot in slots:
+            for key in slot.keys():
+                # XX: 已释放的槽位不会被重新加入
+                pipe.zadd(key, {slot.member: expire_at}, xx=True)
+                pipe.expire(key, int(self.lease))
+        pipe.execute()
+
+    def acquire(self, access_token: str, share_token: Optional[str]) -> Slot:
+        """
+        占用一个会话并发槽位
+
+        账号或分享的并发已满时进入同一个排队队列，按分享轮转获得槽位
+
+        Raises:
+            SchedulerRejected: 排队已满或排队超时
+        """
+        account = hashlib.sha256(access_token.encode()).hexdigest()[:16]
+        # 无分享时以账号作为排队标识，不受分享上限约束
+        share = share_token or account
+        shared = share_token is not None
+        try:
+            with self._lock:
+                queue = self._queues.get(account)
+                queued = queue is not None and queue.size > 0
+            if not queued:
+                result, slot = self._try_acquire(account, share, shared)
+                if result == 1:
+                    SCHEDULER_DECISIONS_TOTAL.labels('admitted').inc()
+                    return slot
+            return self._wait(account, share, shared, share_full=not queued and result == -1)
+        except SchedulerRejected:
+            raise
+        except Exception as e:
+            # Redis 异常时放行，避免调度故障影响正常使用
+            logger.error("Error acquiring stream slot: %s", e)
+            SCHEDULER_DECISIONS_TOTAL.labels('error').inc()
+            return Slot(None, account, share, '', shared)
+
+    def _reject(self, result: str, status: int, detail: str, retry_after: int) -> SchedulerRejected:
+        SCHEDULER_DECISIONS_TOTAL.labels(result).inc()
+        return SchedulerRejected(status, detail, retry_after)
+
+    def _wait(self, account: str, share: str, shared: bool, share_full: bool = False) -> Slot:
+        waiter = _Waiter(share)
+        with self._lock:
+            queue = self._queues.setdefault(account, _AccountQueue())
+            if queue.queued(share) >= self.max_share_queue:
+                raise self._reject('queue_full', 429, '当前分享排队的会话过多，请稍后再试', 5)
+            if queue.size >= self.max_queue:
+                raise self._reject('queue_full', 429, '当前账号排队人数过多，请稍后再试', 10)
+            queue.push(waiter)
+            if share_full and queue.share_head(share) is waiter:
+                queue.blocked.add(share)
+        SCHEDULER_QUEUED.inc()
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        granted = False
+        try:
+            while True:
+                with self._lock:
+                    eligible = queue.eligible(waiter)
+                if eligible:
+                    result, slot = self._try_acquire(account, share, shared)
+                    if result == 1:
+                        granted = True
+                        SCHEDULER_DECISIONS_TOTAL.labels('queued').inc()
+                        return slot
+                    with self._lock:
+                        if result == -1:
+                            if share not in queue.blocked:
+                                # 本分享已满，让下一个分享先尝试
+                                queue.blocked.add(share)
+                                self._wake_head(account)
+                        else:
+                            queue.blocked.discard(share)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        share_full = share in queue.blocked
+                    if share_full:
+                        raise self._reject('share_limit', 429, '当前分享同时进行的会话过多，请稍后再试', 5)
+                    raise self._reject('timeout', 503, '当前账号繁忙，请稍后再试', 5)
+                waiter.event.wait(min(self.poll_interval, remaining))
+                waiter.event.clear()
+        finally:
+            SCHEDULER_QUEUED.dec()
+            SCHEDULER_WAIT_SECONDS.observe(time.monotonic() - start)
+            with self._lock:
+                queue.remove(waiter, granted)
+                self._wake_head(account)
+
+    def _wake_head(self, account: str, share: Optional[str] = None) -> None:
+        queue = self._queues.get(account)
+        if queue is None:
+            return
+        if queue.size == 0:
+            del self._queues[account]
+            return
+        head = queue.head()
+        if head is not None:
+            head.event.set()
+        if share is not None:
+            # 释放的槽位属于该分享，其排队者不再受分享上限阻塞
+            queue.blocked.discard(share)
+            share_head = queue.share_head(share)
+            if share_head is not None:
+                share_head.event.set()
+
+    def _release(self, slot: Slot) -> None:
+        with self._lock:
+            self._active.discard(slot)
+        try:
+            pipe = self.redis_utils.redis_client.pipeline(transaction=False)
+            for key in slot.keys():
+                pipe.zrem(key, slot.member)
+            pipe.execute()
+        except Exception as e:
+            logger.error("Error releasing stream slot: %s", e)
+        with self._lock:
+            self._wake_head(slot.account, slot.share)
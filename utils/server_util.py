@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from hypercorn.asyncio import serve
+from hypercorn.config import Config as HypercornConfig
+from hypercorn.middleware import AsyncioWSGIMiddleware
+
+from utils.admission_util import ACCEPTED_ENVIRON
+
+logger = logging.getLogger(__name__)
+
+# ASGI scope 只有请求头能传到 WSGI environ，读完请求体的时间借内部请求头传递
+ACCEPTED_HEADER = b'x-mirror-accepted'
+
+
+def _with_first_chunk(wsgi_app):
+    """
+    hypercorn 的 WSGI 包装层在收到首个响应块时才发送响应头，
+    响应体为空（HEAD、304、空 body）时补一个空块，否则会以 500 结束；
+    同时把 MirrorASGI 写入的接收时间从请求头移到 environ
+    """
+    def app(environ, start_response):
+        accepted = environ.pop('HTTP_X_MIRROR_ACCEPTED', None)
+        if accepted is not None:
+            environ[ACCEPTED_ENVIRON] = float(accepted)
+        return _iter_with_first_chunk(wsgi_app(environ, start_response))
+    return app
+
+
+def _iter_with_first_chunk(body):
+    try:
+        empty = True
+        for chunk in body:
+            empty = False
+            yield chunk
+        if empty:
+            yield b''
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+class MirrorASGI:
+    def __init__(self, wsgi_app, max_body_size: int = 16 * 1024 * 1024, websocket=None):
+        """
+        组合 ASGI 应用：HTTP 请求交给 Flask(WSGI) 处理，WebSocket 交给中继，lifespan 直接应答
+
+        Args:
+            wsgi_app: Flask 应用
+            max_body_size: 请求体上限（字节），WSGI 包装层会先读完整个请求体
+            websocket: 处理 WebSocket 的 ASGI 应用（提供 close()），为空时拒绝握手
+        """
+        self.http = AsyncioWSGIMiddleware(_with_first_chunk(wsgi_app), max_body_size=max_body_size)
+        self.websocket = websocket
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] == 'http':
+            # 去掉客户端伪造的同名头，读完请求体后记下时间，线程池排队计入准入控制的排队延迟
+            headers = [(k, v) for k, v in scope['headers'] if k.lower() != ACCEPTED_HEADER]
+            scope = dict(scope, headers=headers)
+
+            async def receive_body():
+                message = await receive()
+                if message['type'] == 'http.request' and not message.get('more_body'):
+                    headers.append((ACCEPTED_HEADER, f'{time.time():.6f}'.encode()))
+                return message
+
+            await self.http(scope, receive_body, send)
+        elif scope['type'] == 'websocket':
+            if self.websocket is not None:
+                await self.websocket(scope, receive, send)
+            elif (await receive())['type'] == 'websocket.connect':
+                await send({'type': 'websocket.close', 'code': 1008})
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.websocket is not None:
+                    await self.websocket.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+class ServerConfig(HypercornConfig):
+    """保留创建出的 SSLContext，供热加载证书；并设置 TLS1.3 会话票据数量"""
+    num_tickets = 2
+    ssl_context: Optional[ssl.SSLContext] = None
+
+    def create_ssl_context(self) -> Optional[ssl.SSLContext]:
+        if self.ssl_context is None:
+            context = super().create_ssl_context()
+            if context is not None:
+                context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+                context.num_tickets = self.num_tickets
+            self.ssl_context = context
+        return self.ssl_context
+
+
+class HypercornServer:
+    def __init__(self, app, host: str, port: int, ssl_options: Optional[dict] = None, threads: int = 256,
+                 graceful_timeout: float = 30, max_body_size: int = 16 * 1024 * 1024, websocket=None):
+        """
+        hypercorn 监听，TLS 下通过 ALPN 协商 HTTP/2，接口与 werkzeug 的服务器一致，供 Lifecycle 管理
+
+        Args:
+            app: Flask 应用
+            host: 监听地址
+            port: 监听端口
+            ssl_options: 启用 TLS 时的 cert/key/ciphers/session_tickets
+            threads: 运行 Flask 视图的线程数，每个进行中的会话流占用一个
+            graceful_timeout: 停止监听后等待连接处理完成的秒数
+            max_body_size: 请求体上限（字节）
+            websocket: 处理 WebSocket 的 ASGI 应用
+        """
+        self.app = MirrorASGI(app, max_body_size, websocket)
+        self.threads = threads
+        self.config = ServerConfig()
+        self.config.bind = [f"{host}:{port}"]
+        self.config.graceful_timeout = graceful_timeout
+        self.config.accesslog = None
+        # 使用项目的日志配置，不另外输出到 stderr
+        self.config.errorlog = logging.getLogger('hypercorn.error')
+        if ssl_options:
+            self.config.certfile = ssl_options['cert']
+            self.config.keyfile = ssl_options['key']
+            if ssl_options.get('ciphers'):
+                self.config.ciphers = ssl_options['ciphers']
+            self.config.num_tickets = ssl_options.get('session_tickets', ServerConfig.num_tickets)
+            self.config.alpn_protocols = ['h2', 'http/1.1']
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    @property
+    def ssl_context(self) -> Optional[ssl.SSLContext]:
+        return self.config.ssl_context
+
+    def serve_forever(self) -> None:
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        # 默认线程池只有 min(32, CPU+4) 个线程，会限制同时进行的会话流数量
+        executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='wsgi')
+        self._loop.set_default_executor(executor)
+        try:
+            await serve(self.app, self.config, shutdown_trigger=self._stop.wait)
+        finally:
+            executor.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        """停止监听，等待进行中的连接完成（最长 graceful_timeout），可在其他线程调用"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def server_close(self) -> None:
+        pass
@@ -0,0 +1,321 @@
+import json
+import logging
+import threading
+import time
+from dataclasses import fields
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from entity.share import Share
+from utils import metrics_util
+from utils.redis_util import RedisUtils
+
+logger = logging.getLogger(__name__)
+
+SHARE_KEY = 'share_token_info:'
+USER_KEY = 'user_info:'
+CONVERSATIONS_KEY = 'user_conversations:'
+
+# 紧凑编码: "<版本>|<JSON>"
+# v3: 字段名 -> 值，默认值省略，Share 增删或调整字段不影响已有记录
+# v2: 按 V2_FIELDS 顺序排列的 JSON 数组，仍可读取，写入时升级为 v3
+# v1: 旧版哈希结构，读取时自动迁移
+VERSION = 3
+SHARE_FIELDS = [f.name for f in fields(Share)]
+SHARE_DEFAULTS = [f.default for f in fields(Share)]
+# v2 的字段顺序，固定不随 Share 变化
+V2_FIELDS = ('user_name', 'access_token', 'refresh_token', 'gpt_4_limit', 'gpt_4o_limit', 'gpt_4o_mini_limit',
+             'gpt_o1_mini_limit', 'gpto1_preview_limit', 'expire_at', 'gpt_limit_enable', 'temp_conversation_enable')
+
+HOUSEKEEPING_KEYS_TOTAL = metrics_util.REGISTRY.register(metrics_util.Counter(
+    'mirror_housekeeping_keys_total', '后台清理/迁移的键数量', ['action']))
+
+
+def encode(info: Dict[str, Any]) -> str:
+    values = {name: info[name] for name, default in zip(SHARE_FIELDS, SHARE_DEFAULTS)
+              if name in info and info[name] != default}
+    return f"{VERSION}|{json.dumps(values, ensure_ascii=False, separators=(',', ':'))}"
+
+
+def decode(raw: str) -> Optional[Dict[str, Any]]:
+    version, _, payload = raw.partition('|')
+    if version == str(VERSION):
+        values = json.loads(payload)
+    elif version == '2':
+        array = json.loads(payload)
+        if len(array) > len(V2_FIELDS):
+            logger.warning("Malformed v2 share record with %d fields", len(array))
+            return None
+        values = dict(zip(V2_FIELDS, array))
+    else:
+        logger.warning("Unknown share record version: %s", version)
+        return None
+    info = dict(zip(SHARE_FIELDS, SHARE_DEFAULTS))
+    # 已从 Share 移除的字段忽略
+    info.update((name, value) for name, value in values.items() if name in info)
+    return info
+
+
+def expire_timestamp(info: Dict[str, Any]) -> Optional[int]:
+    """根据 expire_at 计算键的过期时间戳，未设置时返回 None"""
+    try:
+        expire_at = int(info.get('expire_at', -1))
+    except (TypeError, ValueError):
+        return None
+    if expire_at <= 0:
+        return None
+    # 兼容毫秒时间戳
+    return expire_at // 1000 if expire_at > 10 ** 12 else expire_at
+
+
+def save_share(redis_utils: RedisUtils, share_token: str, info: Dict[str, Any], pipe=None) -> None:
+    """
+    写入分享信息，设置了 expire_at 的分享到期后自动删除
+
+    Args:
+        redis_utils: Redis 工具
+        share_token: 分享 token
+        info: 分享字段
+        pipe: 可选的 pipeline，传入时只追加命令不执行
+    """
+    client = pipe if pipe is not None else redis_utils.redis_client
+    key = SHARE_KEY + share_token
+    expire_at = expire_timestamp(info)
+    client.set(key, encode(info))
+    if expire_at is not None:
+        client.expireat(key, expire_at)
+
+
+def _load(redis_utils: RedisUtils, share_token: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """返回 (原始记录, 分享信息)，兼容旧版哈希结构并自动迁移"""
+    key = SHARE_KEY + share_token
+    for _ in range(2):
+        try:
+            raw = redis_utils.redis_client.get(key)
+        except Exception as e:
+            if not RedisUtils.is_wrong_type(e):
+                logger.error("Error getting share: %s", e)
+                return None, None
+            info = _migrate(redis_utils, share_token)
+            if info is not None:
+                return encode(info), info
+            # 同一记录正被其他请求迁移，重新读取一次
+            continue
+        return raw, decode(raw) if raw is not None else None
+    return None, None
+
+
+def get_share(redis_utils: RedisUtils, share_token: str) -> Optional[Dict[str, Any]]:
+    """读取分享信息，兼容旧版哈希结构并自动迁移"""
+    return _load(redis_utils, share_token)[1]
+
+
+def get_share_field(redis_utils: RedisUtils, share_token: str, name: str) -> Any:
+    info = get_share(redis_utils, share_token)
+    return info.get(name) if info is not None else None
+
+
+# 记录仍为读取时的值才写入并保留 TTL；读取后被替换或删除的分享不会被重新创建
+UPDATE_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'KEEPTTL')
+local expire_at = tonumber(ARGV[3])
+if expire_at > 0 then
+    redis.call('EXPIREAT', KEYS[1], expire_at)
+end
+return 1
+"""
+UPDATE_ATTEMPTS = 3
+
+
+def update_share(redis_utils: RedisUtils, share_token: str, **changes: Any) -> bool:
+    """修改分享的部分字段，保留原有过期时间；分享不存在或已被删除时返回 False"""
+    script = redis_utils.redis_client.register_script(UPDATE_SCRIPT)
+    for _ in range(UPDATE_ATTEMPTS):
+        raw, info = _load(redis_utils, share_token)
+        if info is None:
+            return False
+        info.update(changes)
+        if int(script(keys=[SHARE_KEY + share_token], args=[raw, encode(info), expire_timestamp(info) or 0])):
+            return True
+        # 读取与写入之间被并发修改，重新读取
+    logger.warning("Share update gave up after concurrent modifications")
+    return False
+
+
+# 原子替换用户的分享：删除旧分享、写入新分享与 user_info，并设置过期时间
+# 旧 share_token 由客户端预先读取，旧分享键通过 KEYS[3] 声明；user_info 已被他人修改时不写入，返回 {0, 当前值} 由客户端重试
+PROVISION_SCRIPT = """
+local former = redis.call('GET', KEYS[1]) or ''
+if former ~= ARGV[4] then
+    return {0, former}
+end
+if former ~= '' and former ~= ARGV[1] then
+    redis.call('DEL', KEYS[3])
+end
+redis.call('SET', KEYS[2], ARGV[2])
+redis.call('SET', KEYS[1], ARGV[1])
+local expire_at = tonumber(ARGV[3])
+if expire_at > 0 then
+    redis.call('EXPIREAT', KEYS[2], expire_at)
+    redis.call('EXPIREAT', KEYS[1], expire_at)
+end
+return {1, former}
+"""
+PROVISION_ATTEMPTS = 3
+
+
+def provision_shares(redis_utils: RedisUtils, shares: List[Tuple[str, Dict[str, Any]]],
+                     batch: int = 1000) -> List[Union[Optional[str], Exception]]:
+    """
+    批量写入分享，每条记录在 Redis 端原子执行，按批次 pipeline 提交
+    某一批失败时停止写入，已提交的批次仍返回各自结果
+
+    Args:
+        redis_utils: Redis 工具
+        shares: [(share_token, 分享字段)]，同一批中 user_name 不应重复
+        batch: 每个 pipeline 的记录数
+
+    Returns:
+        List[Union[Optional[str], Exception]]: 每条记录被替换掉的旧 share_token，写入失败的记录为对应异常
+    """
+    client = redis_utils.redis_client
+    script = client.register_script(PROVISION_SCRIPT)
+    results: List[Union[Optional[str], Exception]] = []
+    for start in range(0, len(shares), batch):
+        chunk = shares[start:start + batch]
+        try:
+            results.extend(_provision_batch(client, script, chunk))
+        except Exception as e:
+            logger.error("Share provisioning failed at record %d: %s", start, e)
+            results.extend([e] * (len(shares) - start))
+            break
+    return results
+
+
+def _provision_batch(client, script, chunk: List[Tuple[str, Dict[str, Any]]]) -> List[Union[Optional[str], Exception]]:
+    results: List[Union[Optional[str], Exception]] = [None] * len(chunk)
+    pending = list(range(len(chunk)))
+    for _ in range(PROVISION_ATTEMPTS):
+        pipe = client.pipeline(transaction=False)
+        for i in pending:
+            pipe.get(USER_KEY + chunk[i][1]['user_name'])
+        expected = [former or '' for former in pipe.execute()]
+        pipe = client.pipeline(transaction=False)
+        for i, former in zip(pending, expected):
+            share_token, info = chunk[i]
+            script(
+                keys=[USER_KEY + info['user_name'], SHARE_KEY + share_token, SHARE_KEY + (former or share_token)],
+                args=[share_token, encode(info), expire_timestamp(info) or 0, former],
+                client=pipe
+            )
+        retry = []
+        for i, reply in zip(pending, pipe.execute(raise_on_error=False)):
+            if isinstance(reply, Exception):
+                results[i] = reply
+            elif int(reply[0]) == 1:
+                results[i] = reply[1] or None
+            else:
+                # 读取与写入之间 user_info 被并发修改
+                retry.append(i)
+        pending = retry
+        if not pending:
+            break
+    for i in pending:
+        results[i] = RuntimeError('user_info 并发修改，写入未完成')
+    return results
+
+
+def _migrate(redis_utils: RedisUtils, share_token: str) -> Optional[Dict[str, Any]]:
+    key = SHARE_KEY + share_token
+    # 已被其他请求迁移
+    if redis_utils.redis_client.type(key) != 'hash':
+        return None
+    legacy = redis_utils.hash_get(key)
+    if not legacy:
+        return None
+    info = dict(zip(SHARE_FIELDS, SHARE_DEFAULTS))
+    info.update({k: v for k, v in legacy.items() if k in info})
+    pipe = redis_utils.redis_client.pipeline()
+    pipe.delete(key)
+    save_share(redis_utils, share_token, info, pipe)
+    if info.get('user_name') and expire_timestamp(info) is not None:
+        pipe.expireat(USER_KEY + info['user_name'], expire_timestamp(info))
+    pipe.execute()
+    return info
+
+
+class Housekeeper:
+    def __init__(self, redis_utils: RedisUtils, interval: float = 300, batch: int = 200, max_keys: int = 5000):
+        """
+        后台清理孤立的 user_info / user_conversations，并迁移旧版分享记录
+
+        Args:
+            redis_utils: Redis 工具
+            interval: 每轮间隔（秒）
+            batch: 每次 SCAN 的 COUNT
+            max_keys: 每轮每种键最多检查的数量，游标保存在 Redis 中，下一轮继续
+        """
+        self.redis_utils = redis_utils
+        self.interval = interval
+        self.batch = batch
+        self.max_keys = max_keys
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='housekeeping', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Housekeeping failed: %s", e)
+
+    def run_once(self) -> None:
+        client = self.redis_utils.redis_client
+        # 多进程部署时每轮只由一个进程执行
+        if not client.set('housekeeping:lock', '1', nx=True, ex=max(int(self.interval), 1)):
+            return
+        self._sweep(SHARE_KEY + '*', self._check_share)
+        self._sweep(USER_KEY + '*', self._check_user)
+        self._sweep(CONVERSATIONS_KEY + '*', self._check_conversations)
+
+    def _sweep(self, pattern: str, check) -> None:
+        client = self.redis_utils.redis_client
+        cursor_key = 'housekeeping:cursor:' + pattern
+        cursor = int(client.get(cursor_key) or 0)
+        checked = 0
+        while checked < self.max_keys:
+            cursor, keys = client.scan(cursor, match=pattern, count=self.batch)
+            for key in keys:
+                check(key)
+            checked += len(keys)
+            if cursor == 0:
+                break
+        client.set(cursor_key, cursor)
+
+    def _check_share(self, key: str) -> None:
+        if self.redis_utils.redis_client.type(key) == 'hash':
+            _migrate(self.redis_utils, key[len(SHARE_KEY):])
+            HOUSEKEEPING_KEYS_TOTAL.labels('migrate_share').inc()
+
+    def _check_user(self, key: str) -> None:
+        client = self.redis_utils.redis_client
+        share_token = client.get(key)
+        if share_token is None or client.exists(SHARE_KEY + str(share_token)):
+            return
+        client.delete(key)
+        HOUSEKEEPING_KEYS_TOTAL.labels('delete_user_info').inc()
+
+    def _check_conversations(self, key: str) -> None:
+        client = self.redis_utils.redis_client
+        if client.exists(USER_KEY + key[len(CONVERSATIONS_KEY):]):
+            return
+        client.delete(key)
+        HOUSEKEEPING_KEYS_TOTAL.labels('delete_user_conversations').inc()
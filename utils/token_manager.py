@@ -0,0 +1,283 @@
+import base64
+import hashlib
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from utils import metrics_util, share_store
+from utils.log_util import log_event
+from utils.redis_util import RedisUtils
+from utils.token_util import check_access_token, refresh_to_access
+
+logger = logging.getLogger(__name__)
+
+TOKEN_REFRESH_TOTAL = metrics_util.REGISTRY.register(metrics_util.Counter(
+    'mirror_token_refresh_total', '后台刷新 access_token 次数', ['result']))
+
+
+@lru_cache(maxsize=4096)
+def decode_exp(token: str) -> Optional[int]:
+    """
+    读取 access_token(JWT) 中的过期时间，不校验签名
+
+    Returns:
+        Optional[int]: exp 时间戳，无法解析时返回 None
+    """
+    if token.startswith('Bearer '):
+        token = token[7:]
+    parts = token.split('.')
+    if len(parts) != 3:
+        return None
+    try:
+        payload = parts[1] + '=' * (-len(parts[1]) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        return int(exp) if exp is not None else None
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class CheckResult:
+    """与 requests.Response 兼容的最小结构，供 /api/check 直接返回"""
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+
+class _Tracked:
+    def __init__(self, refresh_token: str, access_token: str):
+        self.refresh_token = refresh_token
+        self.access_token = access_token
+        self.share_tokens: Set[str] = set()
+        self.failures = 0
+        # 当前有效的调度时间，堆中与之不符的条目已过时；刷新进行中为 None
+        self.due: Optional[float] = None
+
+
+class TokenManager:
+    def __init__(self, redis_utils: RedisUtils, refresh_lead: float = 600, refresh_jitter: float = 300,
+                 concurrency: int = 4, check_ttl: float = 300, negative_ttl: float = 30,
+                 default_interval: float = 3600, refresh_lock: float = 60,
+                 checker: Callable = check_access_token, refresher: Callable = refresh_to_access):
+        """
+        access_token 有效期缓存与后台刷新
+
+        Args:
+            redis_utils: Redis 工具
+            refresh_lead: 提前多少秒刷新
+            refresh_jitter: 刷新时间随机抖动上限（秒），避免集中刷新
+            concurrency: 同时进行的刷新请求上限
+            check_ttl: /api/check 成功结果缓存秒数（不超过 token 过期时间）
+            negative_ttl: /api/check 失败结果缓存秒数
+            default_interval: 无法解析过期时间时的刷新周期
+            refresh_lock: 刷新锁秒数，多进程部署时同一 refresh_token 在此期间只由一个进程刷新
+        """
+        self.redis_utils = redis_utils
+        self.refresh_lead = refresh_lead
+        self.refresh_jitter = refresh_jitter
+        self.check_ttl = check_ttl
+        self.negative_ttl = negative_ttl
+        self.default_interval = default_interval
+        self.refresh_lock = refresh_lock
+        self.checker = checker
+        self.refresher = refresher
+        self._check_cache: Dict[str, Tuple[float, CheckResult]] = {}
+        self._check_locks: Dict[str, threading.Lock] = {}
+        self._tracked: Dict[str, _Tracked] = {}
+        # share_token -> refresh_token
+        self._share_index: Dict[str, str] = {}
+        self._schedule: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='token-refresh')
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- /api/check 缓存 ----------
+
+    def check(self, m_token: str) -> CheckResult:
+        """token 有效期内直接返回缓存结果，已过期的 token 不再请求上游"""
+        now = time.time()
+        exp = decode_exp(m_token)
+        if exp is not None and exp <= now:
+            metrics_util.record_cache('token_check', True)
+            return CheckResult(401, b'{"detail":"access token expired"}')
+
+        cached = self._check_cache.get(m_token)
+        if cached is not None and cached[0] > now:
+            metrics_util.record_cache('token_check', True)
+            return cached[1]
+
+        # 相同 token 的并发请求只回源一次
+        with self._lock:
+            key_lock = self._check_locks.setdefault(m_token, threading.Lock())
+        with key_lock:
+            cached = self._check_cache.get(m_token)
+            if cached is not None and cached[0] > time.time():
+                metrics_util.record_cache('token_check', True)
+                return cached[1]
+            metrics_util.record_cache('token_check', False)
+            try:
+                resp = self.checker(m_token)
+                result = CheckResult(resp.status_code, resp.content)
+                ttl = self.check_ttl if resp.status_code == 200 else self.negative_ttl
+                expires_at = time.time() + ttl
+                if exp is not None:
+                    expires_at = min(expires_at, exp)
+                with self._lock:
+                    self._evict_expired()
+                    self._check_cache[m_token] = (expires_at, result)
+            finally:
+                # 上游请求异常时同样移除，避免锁对象残留
+                with self._lock:
+                    self._check_locks.pop(m_token, None)
+            return result
+
+    def _evict_expired(self) -> None:
+        if len(self._check_cache) < 1024:
+            return
+        now = time.time()
+        for key in [k for k, (expires_at, _) in self._check_cache.items() if expires_at <= now]:
+            del self._check_cache[key]
+
+    # ---------- 后台刷新 ----------
+
+    def track(self, share_token: str, access_token: str, refresh_token: str) -> None:
+        """登记带 refresh_token 的分享，过期前在后台刷新其 access_token；分享改用其他 refresh_token 时替换原登记"""
+        with self._lock:
+            if self._share_index.get(share_token) != refresh_token:
+                self._detach(share_token)
+            if not refresh_token:
+                return
+            tracked = self._tracked.get(refresh_token)
+            if tracked is None:
+                tracked = self._tracked[refresh_token] = _Tracked(refresh_token, access_token)
+                self._push(tracked, self._due(access_token))
+            tracked.share_tokens.add(share_token)
+            self._share_index[share_token] = refresh_token
+
+    def untrack(self, share_token: str) -> None:
+        with self._lock:
+            self._detach(share_token)
+
+    def _detach(self, share_token: str) -> None:
+        refresh_token = self._share_index.pop(share_token, None)
+        tracked = self._tracked.get(refresh_token) if refresh_token is not None else None
+        if tracked is None:
+            return
+        tracked.share_tokens.discard(share_token)
+        if not tracked.share_tokens:
+            del self._tracked[refresh_token]
+
+    def _due(self, access_token: str) -> float:
+        exp = decode_exp(access_token) if access_token else None
+        if exp is None:
+            return time.time() + self.default_interval * random.uniform(0.5, 1.0)
+        return exp - self.refresh_lead - random.uniform(0, self.refresh_jitter)
+
+    def _push(self, tracked: _Tracked, due: float) -> None:
+        if len(self._schedule) > 2 * len(self._tracked) + 1024:
+            # 反复取消/重新登记留下的过时条目过多时重建
+            self._schedule = [(t.due, t.refresh_token) for t in self._tracked.values() if t.due is not None]
+            heapq.heapify(self._schedule)
+        tracked.due = due
+        heapq.heappush(self._schedule, (due, tracked.refresh_token))
+        self._wakeup.notify()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='token-scheduler', daemon=True)
+        self._thread.start()
+
+    def _load(self) -> None:
+        """启动时从 Redis 恢复需要刷新的分享"""
+        for key in self.redis_utils.scan_keys(share_store.SHARE_KEY + '*'):
+            share_token = key[len(share_store.SHARE_KEY):]
+            info = share_store.get_share(self.redis_utils, share_token)
+            if info and info.get('refresh_token'):
+                self.track(share_token, str(info.get('access_token', '')), str(info['refresh_token']))
+
+    def _run(self) -> None:
+        self._load()
+        while True:
+            with self._lock:
+                while not self._schedule or self._schedule[0][0] > time.time():
+                    timeout = self._schedule[0][0] - time.time() if self._schedule else None
+                    self._wakeup.wait(timeout)
+                due, refresh_token = heapq.heappop(self._schedule)
+                tracked = self._tracked.get(refresh_token)
+                # 已取消登记，或重新登记/重新调度后留下的旧条目
+                if tracked is None or tracked.due != due:
+                    continue
+                tracked.due = None
+            self._executor.submit(self._refresh, refresh_token)
+
+    def _claim(self, refresh_token: str) -> bool:
+        """多进程部署时每个 refresh_token 只由抢到锁的进程请求上游，Redis 异常时放行"""
+        key = 'token_refresh:lock:' + hashlib.sha256(refresh_token.encode()).hexdigest()[:16]
+        try:
+            return bool(self.redis_utils.redis_client.set(key, '1', nx=True, ex=max(int(self.refresh_lock), 1)))
+        except Exception as e:
+            logger.error("Error claiming token refresh: %s", e)
+            return True
+
+    def _stored_access_token(self, share_tokens: List[str]) -> Optional[str]:
+        for share_token in share_tokens:
+            access_token = share_store.get_share_field(self.redis_utils, share_token, 'access_token')
+            if access_token:
+                return str(access_token)
+        return None
+
+    def _refresh(self, refresh_token: str) -> None:
+        tracked = self._tracked.get(refresh_token)
+        if tracked is None:
+            return
+        with self._lock:
+            share_tokens = list(tracked.share_tokens)
+        # 其他进程已刷新并写回分享时直接采用，不再请求上游
+        stored = self._stored_access_token(share_tokens)
+        if stored and stored != tracked.access_token:
+            exp = decode_exp(stored)
+            if exp is None or exp - self.refresh_lead > time.time():
+                with self._lock:
+                    tracked.access_token = stored
+                    tracked.failures = 0
+                    self._push(tracked, self._due(stored))
+                TOKEN_REFRESH_TOTAL.labels('adopted').inc()
+                return
+        if not self._claim(refresh_token):
+            # 其他进程正在刷新，锁到期后读取其结果
+            with self._lock:
+                self._push(tracked, time.time() + self.refresh_lock)
+            TOKEN_REFRESH_TOTAL.labels('skipped').inc()
+            return
+        try:
+            access_token = self.refresher(refresh_token)
+        except Exception as e:
+            logger.warning("Refresh access token failed: %s", e)
+            access_token = None
+
+        with self._lock:
+            if access_token:
+                tracked.access_token = access_token
+                tracked.failures = 0
+                share_tokens = list(tracked.share_tokens)
+                self._push(tracked, self._due(access_token))
+            else:
+                tracked.failures += 1
+                share_tokens = []
+                self._push(tracked, time.time() + min(60 * 2 ** (tracked.failures - 1), 1800))
+
+        TOKEN_REFRESH_TOTAL.labels('success' if access_token else 'failure').inc()
+        for share_token in share_tokens:
+            # 分享已被替换或删除时不会重新写入，此后也不再刷新
+            if not share_store.update_share(self.redis_utils, share_token, access_token=access_token) and \
+                    share_store.get_share(self.redis_utils, share_token) is None:
+                self.untrack(share_token)
+        log_event(logger, 'token_refreshed', success=bool(access_token), shares=len(share_tokens))
@@ -1,19 +1,19 @@
 import hashlib
-import os
+import logging
+import time
 
 import requests
 
 from entity.share import Share
+from utils.egress_util import egress_pool, is_egress_failure
+from utils.log_util import log_event
 from utils.redis_util import RedisUtils
 
+logger = logging.getLogger(__name__)
+
 
 def refresh_to_access(refresh_token: str):
-    if os.getenv('PROXY', '') != '':
-        proxy_cfg = {
-            'http': os.getenv('PROXY', '').split(",")[0],
-            'https': os.getenv('PROXY', '').split(",")[0]
-        }
-        requests.Session().proxies.update(proxy_cfg)
+    egress = egress_pool.select(refresh_token)
 
     headers = {
         "Content-Type": "application/json",
@@ -24,11 +24,18 @@ def refresh_to_access(refresh_token: str):
         "grant_type": "refresh_token",
         "client_id": "pdlLIX2Y72MIl2rhLhTE9VV9bN905kBh"
     }
-    resp = requests.post(
-        url="https://auth0.openai.com/oauth/token",
-        headers=headers,
-        json=req_body
-    )
+    start = time.perf_counter()
+    try:
+        resp = requests.post(
+            url="https://auth0.openai.com/oauth/token",
+            headers=headers,
+            json=req_body,
+            proxies=egress_pool.proxies(egress)
+        )
+    except requests.RequestException:
+        egress_pool.report(egress, time.perf_counter() - start, False)
+        raise
+    egress_pool.report(egress, resp.elapsed.total_seconds(), not is_egress_failure(resp.status_code))
     if resp.status_code == 200:
         return resp.json()['access_token']
     else:
@@ -67,11 +74,18 @@ def check_access_token(m_token: str):
     }
 
     # 使用 session 发起请求
-    resp = requests.get(
-        url="https://chatgpt.com/backend-api/accounts/check/v4-2023-04-27?timezone_offset_min=-480",
-        headers=headers,
-        allow_redirects=True  # 允许重定向
-    )
-    # 打印响应信息
-    print(resp.text)
+    egress = egress_pool.select(m_token)
+    start = time.perf_counter()
+    try:
+        resp = requests.get(
+            url="https://chatgpt.com/backend-api/accounts/check/v4-2023-04-27?timezone_offset_min=-480",
+            headers=headers,
+            allow_redirects=True,  # 允许重定向
+            proxies=egress_pool.proxies(egress)
+        )
+    except requests.RequestException:
+        egress_pool.report(egress, time.perf_counter() - start, False)
+        raise
+    egress_pool.report(egress, resp.elapsed.total_seconds(), not is_egress_failure(resp.status_code))
+    log_event(logger, 'check_access_token', logging.DEBUG, status=resp.status_code, bytes=len(resp.content))
     return resp
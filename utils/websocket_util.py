@@ -0,0 +1,269 @@
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import time
+from fnmatch import fnmatch
+from http.cookies import SimpleCookie
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, quote, urlparse
+
+from utils import metrics_util
+from utils.common_util import build_target_url, find_conversation_id
+from utils.egress_util import EgressPool
+
+logger = logging.getLogger(__name__)
+
+# register-websocket 返回的 wss_url 改写为本地中继地址，原地址放在 target 参数中
+RELAY_PATH = '/ws-relay'
+# 中继允许连接的上游主机
+DEFAULT_ALLOWED_HOSTS = ('*.webpubsub.azure.com', 'chatgpt.com', '*.chatgpt.com')
+# 转发给上游的客户端握手头
+FORWARD_HEADERS = ('user-agent', 'accept-language')
+
+WEBSOCKETS_IN_FLIGHT = metrics_util.REGISTRY.register(metrics_util.Gauge(
+    'mirror_websockets_in_flight', '正在中继的 WebSocket 连接数'))
+
+
+def relay_url(wss_url: str, secure: bool, host: str) -> str:
+    """生成客户端连接的本地中继地址"""
+    scheme = 'wss' if secure else 'ws'
+    return f"{scheme}://{host}{RELAY_PATH}?target={quote(wss_url, safe='')}"
+
+
+def host_allowed(url: str, allowed_hosts: Iterable[str]) -> bool:
+    parsed = urlparse(url)
+    return parsed.scheme in ('ws', 'wss') and any(fnmatch(parsed.hostname or '', p) for p in allowed_hosts)
+
+
+def _scan_sse(payload: bytes, ids: List[str]) -> None:
+    for line in payload.split(b'\n'):
+        conversation_id = find_conversation_id(line.strip())
+        if conversation_id:
+            ids.append(conversation_id)
+
+
+def _walk_frame(value, ids: List[str], depth: int = 0) -> None:
+    if depth > 4:
+        return
+    if isinstance(value, dict):
+        if value.get('type') == 'conversation_detail_metadata' and value.get('conversation_id'):
+            ids.append(value['conversation_id'])
+            return
+        body = value.get('body')
+        if isinstance(body, str) and 'conversation_detail_metadata' not in body:
+            # 响应体以 base64 传输
+            try:
+                decoded = base64.b64decode(body, validate=True)
+            except (binascii.Error, ValueError):
+                decoded = b''
+            if b'conversation_detail_metadata' in decoded:
+                _scan_sse(decoded, ids)
+        for item in value.values():
+            _walk_frame(item, ids, depth + 1)
+    elif isinstance(value, list):
+        for item in value:
+            _walk_frame(item, ids, depth + 1)
+    elif isinstance(value, str) and 'conversation_detail_metadata' in value:
+        _scan_sse(value.encode(), ids)
+
+
+def find_frame_conversation_ids(text: str) -> List[str]:
+    """
+    从中继的文本帧中识别会话 ID：SSE 事件可能直接作为帧内容、嵌在 JSON 字段中，或以 base64 放在 body 字段
+
+    Returns:
+        List[str]: 帧中出现的 conversation_detail_metadata 会话 ID
+    """
+    if 'conversation_detail_metadata' not in text and '"body"' not in text:
+        return []
+    ids: List[str] = []
+    try:
+        frame = json.loads(text)
+    except ValueError:
+        _scan_sse(text.encode(), ids)
+        return ids
+    _walk_frame(frame, ids)
+    return ids
+
+
+def _close_code(code: Optional[int]) -> int:
+    # 1005/1006 等保留码不能在关闭帧中发送
+    if code is not None and (1000 <= code <= 1003 or 1007 <= code <= 1014 or 3000 <= code < 5000):
+        return code
+    return 1000
+
+
+class WebSocketRelay:
+    def __init__(self, resolve_auth: Callable[[Optional[str], Optional[str]], Tuple[Optional[str], str]],
+                 on_conversation: Callable[[str, str, str], None], egress_pool: EgressPool,
+                 is_draining: Callable[[], bool] = lambda: False,
+                 allowed_hosts: Iterable[str] = DEFAULT_ALLOWED_HOSTS, max_message_size: int = 16 * 1024 * 1024):
+        """
+        ASGI WebSocket 中继：每个连接只占用两个协程，空闲连接不占线程
+
+        Args:
+            resolve_auth: (Authorization 头, share_token) -> (access_token, 用户名)，同 proxy() 的鉴权
+            on_conversation: (用户名, access_token, 会话 ID)，识别到新会话时登记归属
+            egress_pool: 出口代理池，同一 share_token 固定走同一出口
+            is_draining: 停机排空时拒绝新连接
+            allowed_hosts: 中继允许连接的上游主机（fnmatch 通配）
+            max_message_size: 单条消息上限（字节）
+        """
+        self.resolve_auth = resolve_auth
+        self.on_conversation = on_conversation
+        self.egress_pool = egress_pool
+        self.is_draining = is_draining
+        self.allowed_hosts = tuple(allowed_hosts)
+        self.max_message_size = max_message_size
+        self._session = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing: Optional[asyncio.Event] = None
+
+    def _client_session(self):
+        # 会话绑定事件循环，在首个连接时于循环内创建；aiohttp 导入较慢，延迟到首次使用
+        if self._session is None or self._session.closed:
+            import aiohttp
+            # 默认连接器最多 100 个连接，WebSocket 长期占用连接，不设上限
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0),
+                                                  timeout=aiohttp.ClientTimeout(total=None, sock_connect=15))
+        return self._session
+
+    async def __call__(self, scope, receive, send) -> None:
+        if self._closing is None:
+            self._loop = asyncio.get_running_loop()
+            self._closing = asyncio.Event()
+        headers: Dict[str, str] = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        cookie = SimpleCookie(headers.get('cookie', ''))
+        share_token = cookie['share_token'].value if 'share_token' in cookie else None
+
+        if self.is_draining():
+            await self._reject(receive, send, 'websocket_draining')
+            return
+        # 分享信息读取 Redis，放到线程池避免阻塞事件循环
+        access_token, username = await self._loop.run_in_executor(
+            None, self.resolve_auth, headers.get('authorization'), share_token)
+        if not access_token:
+            await self._reject(receive, send, 'websocket_unauthorized')
+            return
+
+        upstream_headers = {k: headers[k] for k in FORWARD_HEADERS if k in headers}
+        upstream_headers['Origin'] = 'https://chatgpt.com'
+        if scope['path'] == RELAY_PATH:
+            query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+            target = (query.get('target') or [''])[0]
+            if not host_allowed(target, self.allowed_hosts):
+                await self._reject(receive, send, 'websocket_forbidden')
+                return
+        else:
+            # 其余路径按 HTTP 相同的规则映射到上游并携带账号鉴权
+            target = build_target_url(f"http://localhost{scope['path']}")
+            target = 'ws' + target[4:] if target.startswith('http:') else 'wss' + target[5:]
+            if scope.get('query_string'):
+                target += '?' + scope['query_string'].decode('latin-1')
+            upstream_headers['Authorization'] = f"Bearer {access_token}"
+
+        egress = self.egress_pool.select(share_token)
+        proxy = self.egress_pool.proxies(egress)['https'] or None
+        import aiohttp
+        start = time.perf_counter()
+        # 中继期间一直计入出口并发，长连接也参与出口选择的负载比较
+        self.egress_pool.acquire(egress)
+        try:
+            try:
+                upstream = await self._client_session().ws_connect(
+                    target, headers=upstream_headers, protocols=scope.get('subprotocols') or (), proxy=proxy,
+                    autoping=True, max_msg_size=self.max_message_size, compress=0)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                self.egress_pool.report(egress, time.perf_counter() - start, False)
+                logger.warning("WebSocket upstream connect failed: %s", e)
+                await self._reject(receive, send, 'websocket_upstream_error')
+                return
+            self.egress_pool.report(egress, time.perf_counter() - start, True)
+            metrics_util.observe_stage('upstream_ttfb', time.perf_counter() - start)
+
+            message = await receive()
+            if message['type'] != 'websocket.connect':
+                await upstream.close()
+                return
+            accept = {'type': 'websocket.accept'}
+            if upstream.protocol:
+                accept['subprotocol'] = upstream.protocol
+            await send(accept)
+            metrics_util.REQUESTS_TOTAL.labels('websocket', 101).inc()
+
+            WEBSOCKETS_IN_FLIGHT.inc()
+            relayed = [0]
+            try:
+                await self._relay(upstream, receive, send, username, access_token, relayed)
+            finally:
+                WEBSOCKETS_IN_FLIGHT.dec()
+                metrics_util.observe_stage('websocket', time.perf_counter() - start)
+                metrics_util.RELAYED_BYTES_TOTAL.inc(relayed[0])
+                await upstream.close()
+        finally:
+            self.egress_pool.release(egress)
+
+    async def _relay(self, upstream, receive, send, username: str, access_token: str, relayed: List[int]) -> None:
+        import aiohttp
+        seen: Set[str] = set()
+
+        async def client_to_upstream():
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    return
+                if message.get('text') is not None:
+                    await upstream.send_str(message['text'])
+                elif message.get('bytes') is not None:
+                    await upstream.send_bytes(message['bytes'])
+
+        async def upstream_to_client():
+            async for msg in upstream:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    for conversation_id in find_frame_conversation_ids(msg.data):
+                        if conversation_id not in seen:
+                            seen.add(conversation_id)
+                            # 写入队列满时会同步写 Redis，放到线程池避免阻塞其他连接
+                            await self._loop.run_in_executor(
+                                None, self.on_conversation, username, access_token, conversation_id)
+                    relayed[0] += len(msg.data.encode())
+                    await send({'type': 'websocket.send', 'text': msg.data})
+                elif msg.type == aiohttp.WSMsgType.BINARY:
+                    relayed[0] += len(msg.data)
+                    await send({'type': 'websocket.send', 'bytes': msg.data})
+                else:
+                    break
+            await send({'type': 'websocket.close', 'code': _close_code(upstream.close_code)})
+
+        async def going_away():
+            await self._closing.wait()
+            await send({'type': 'websocket.close', 'code': 1001})
+
+        tasks = [asyncio.ensure_future(client_to_upstream()), asyncio.ensure_future(upstream_to_client()),
+                 asyncio.ensure_future(going_away())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    async def _reject(receive, send, reason: str) -> None:
+        """握手前拒绝，客户端收到的是 HTTP 403，指标按 403 计，原因见日志"""
+        logger.info("WebSocket rejected: %s", reason)
+        metrics_util.REQUESTS_TOTAL.labels('websocket', 403).inc()
+        message = await receive()
+        if message['type'] == 'websocket.connect':
+            await send({'type': 'websocket.close', 'code': 1008})
+
+    def shutdown(self) -> None:
+        """停机时以 1001 关闭所有中继连接，客户端重连到其他实例，可在其他线程调用"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._closing.set)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()